@@ -0,0 +1,220 @@
+import contextlib
+import importlib
+import tracemalloc
+import argparse
+import tempfile
+import shutil
+import time
+import json
+import os
+
+import requests
+
+from stand_in import StandInServer
+
+
+class RedirectedRequests:
+    # stands in for the requests module inside the older PriceGrabber versions
+    # so their hard coded price.tf and backpack.tf urls hit the stand-in servers
+
+    def __init__(self, prices_url: str, backpack_url: str):
+
+        self.urls = {"https://api2.prices.tf": prices_url, "https://backpack.tf/api": backpack_url}
+
+    def redirect(self, url: str):
+
+        for live_url, stand_in_url in self.urls.items():
+
+            if url.startswith(live_url):
+
+                return stand_in_url + url[len(live_url):]
+
+        return url
+
+    def get(self, url: str, **kwargs):
+
+        return requests.get(self.redirect(url), **kwargs)
+
+    def post(self, url: str, **kwargs):
+
+        return requests.post(self.redirect(url), **kwargs)
+
+
+def make_grabber(version: str, prices: StandInServer, backpack: StandInServer, tokens: int = 1):
+    # build a PriceGrabber of a version pointed at the stand-in servers
+
+    module = importlib.import_module(version)
+
+    if version != "main4":
+
+        module.requests = RedirectedRequests(prices.url, backpack.url)
+
+        return module.PriceGrabber(token="bench", api_key="bench")
+
+    from snapshot_scheduler import SnapshotScheduler
+    from retry import RetryPolicy
+
+    # keep to the stand-in's per token snapshot budget if it has one
+    if backpack.token_budget:
+
+        snapshot_scheduler = SnapshotScheduler(budget=backpack.token_budget, window=backpack.token_window)
+
+    else:
+
+        snapshot_scheduler = SnapshotScheduler(budget=10 ** 6, window=1)
+
+    grabber = module.PriceGrabber(token=[f"bench{number}" for number in range(tokens)], api_key="bench",
+                                  prices_url=prices.url, backpack_url=backpack.url,
+                                  snapshot_scheduler=snapshot_scheduler, retry_policy=RetryPolicy(base_delay=0.05))
+
+    # list the skus we sweep in the bulk price list
+    prices.skus.update(row['weapon_sku'] for row in grabber.sku_table.rows)
+    prices.skus.update(row['kit_sku'] for row in grabber.sku_table.rows)
+
+    return grabber
+
+
+# every sweep that can be timed as (version, sweep name, function running it)
+SWEEPS = [
+    ("main", "price", lambda grabber, weapons: grabber.check_killstreak_flipping()),
+    ("mainv2", "refine", lambda grabber, weapons: grabber.check_killstreak_flipping()),
+    ("mainv3", "price", lambda grabber, weapons: grabber.get_killstreak_flipping()),
+    ("mainv3", "refine", lambda grabber, weapons: grabber.validate_killstreak_flipping(
+        [[weapon, [0, 0]] for weapon in weapons])),
+    ("main4", "price", lambda grabber, weapons: grabber.price_ks_flips()),
+    ("main4", "price-async", lambda grabber, weapons: grabber.price_ks_flips(max_workers=8)),
+    ("main4", "price-bulk", lambda grabber, weapons: grabber.price_ks_flips(bulk=True)),
+    ("main4", "sweep", lambda grabber, weapons: grabber.sweep_ks_flips()),
+    ("main4", "sweep-async", lambda grabber, weapons: grabber.sweep_ks_flips(max_workers=8)),
+    ("main4", "refine", lambda grabber, weapons: grabber.refine_ks_flips(dict.fromkeys(weapons, 0))),
+    ("mainv3", "refine-top5", lambda grabber, weapons: grabber.validate_killstreak_flipping(
+        grabber.get_killstreak_flipping(), top_n=5)),
+    ("main4", "refine-top5", lambda grabber, weapons: grabber.refine_ks_flips(grabber.price_ks_flips(), top_n=5)),
+]
+
+
+def run_sweep(version: str, sweep, weapons: list, server_options: dict, tokens: int = 1):
+    # time one sweep against fresh stand-in servers and return its numbers
+
+    with StandInServer(**server_options) as prices, StandInServer(**server_options) as backpack:
+
+        # hide the sweep's printing
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+
+            grabber = make_grabber(version, prices, backpack, tokens=tokens)
+
+            requests_before = prices.total_requests + backpack.total_requests
+
+            tracemalloc.start()
+            start = time.perf_counter()
+
+            sweep(grabber, weapons)
+
+            wall_time = time.perf_counter() - start
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        sent = prices.total_requests + backpack.total_requests - requests_before
+
+    return {'wall_time': wall_time, 'requests': sent, 'requests_per_second': sent / wall_time,
+            'peak_memory': peak_memory}
+
+
+def run(versions: list = None, sweeps: list = None, weapon_count: int = 20, tokens: int = 1, **server_options):
+    # run the chosen sweeps over the first weapon_count weapons in a scratch directory
+
+    with open("killstreakable_weapons_names.txt", encoding='utf-8') as file:
+        weapons = list(dict.fromkeys([weapon for weapon in file.read().split("\n") if weapon != ""]))[:weapon_count]
+
+    results = []
+
+    # import every version before leaving the repo directory
+    for version in dict.fromkeys(version for version, _, _ in SWEEPS):
+
+        if not versions or version in versions:
+
+            importlib.import_module(version)
+
+    start_dir = os.getcwd()
+    scratch_dir = tempfile.mkdtemp(prefix="tf2trade-bench-")
+
+    try:
+
+        os.chdir(scratch_dir)
+
+        # every version reads its weapons from the working directory and main.py and mainv2.py use the old file name
+        for file_name in ("killstreakable_weapons_names.txt", "weapon_names.txt"):
+
+            with open(file_name, "w", encoding='utf-8') as file:
+                file.write("\n".join(weapons))
+
+        for version, sweep_name, sweep in SWEEPS:
+
+            if (versions and version not in versions) or (sweeps and sweep_name not in sweeps):
+
+                continue
+
+            # a broken sweep in an old version should not stop the rest
+            try:
+
+                result = run_sweep(version, sweep, weapons, server_options, tokens=tokens)
+
+            except Exception as error:
+
+                print(f"{version:<8} {sweep_name:<12} failed: {error!r}")
+                results.append({'version': version, 'sweep': sweep_name, 'error': repr(error)})
+
+                continue
+
+            result.update(version=version, sweep=sweep_name)
+
+            results.append(result)
+
+            print(f"{version:<8} {sweep_name:<12} {result['wall_time']:>9.2f}s {result['requests']:>7} requests "
+                  f"{result['requests_per_second']:>9.1f}/s {result['peak_memory'] / 2 ** 20:>8.2f} MiB peak")
+
+    finally:
+
+        os.chdir(start_dir)
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    return results
+
+
+def main(argv: list = None):
+    # run the benchmark from the command line arguments
+
+    parser = argparse.ArgumentParser(prog="bench",
+                                     description="Time PriceGrabber sweeps against local stand-in servers")
+    parser.add_argument("--versions", nargs="*", help="only run these versions ie main4 mainv3")
+    parser.add_argument("--sweeps", nargs="*", help="only run these sweeps ie price refine")
+    parser.add_argument("--weapons", type=int, default=20, help="how many weapons to sweep")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every response")
+    parser.add_argument("--rate-429", type=float, default=0.01, help="share of requests answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1, help="retry-after sent with each 429 in seconds")
+    parser.add_argument("--snapshot-size", type=int, default=200, help="listings in each snapshot")
+    parser.add_argument("--tokens", type=int, default=1, help="backpack.tf tokens main4 spreads snapshots over")
+    parser.add_argument("--token-budget", type=int, default=0,
+                        help="snapshots each token may request per --token-window seconds, 0 for no limit")
+    parser.add_argument("--token-window", type=float, default=60, help="seconds the token budget is counted over")
+    parser.add_argument("--json", help="also write the results to this file")
+
+    args = parser.parse_args(argv)
+
+    bench_results = run(versions=args.versions, sweeps=args.sweeps, weapon_count=args.weapons,
+                        latency=args.latency, rate_429=args.rate_429, retry_after=args.retry_after,
+                        snapshot_size=args.snapshot_size, tokens=args.tokens, token_budget=args.token_budget,
+                        token_window=args.token_window)
+
+    if args.json:
+
+        with open(args.json, "w", encoding='utf-8') as fl:
+
+            json.dump(bench_results, fl, indent=1)
+
+    return bench_results
+
+
+if __name__ == '__main__':
+
+    main()
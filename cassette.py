@@ -0,0 +1,106 @@
+from requests.structures import CaseInsensitiveDict
+import requests
+import threading
+import logging
+import json
+import time
+
+
+# request fields that hold secrets and are never written to a cassette
+SECRET_FIELDS = ('token', 'key')
+
+
+class Cassette:
+
+    def __init__(self, path: str = "cassette.jsonl", mode: str = "record"):
+
+        # "record" appends every request and response to the file
+        # "replay" answers requests from the file without touching the network
+        if mode not in ("record", "replay"):
+
+            raise ValueError(f"Unknown cassette mode {mode}")
+
+        self.path = path
+        self.mode = mode
+
+        # recorded responses by request key, replayed in the order they were recorded
+        self.tapes = {}
+
+        self.lock = threading.Lock()
+
+        if mode == "replay":
+
+            self.load()
+
+    @staticmethod
+    def key(method: str, url: str, params: dict = None, data: dict = None):
+        # identify a request by everything but its secrets
+
+        params = {field: value for field, value in (params or {}).items() if field not in SECRET_FIELDS}
+        data = {field: value for field, value in (data or {}).items() if field not in SECRET_FIELDS}
+
+        return json.dumps([method, url, params, data], sort_keys=True, default=str)
+
+    def load(self):
+
+        with open(self.path, encoding='utf-8') as file:
+
+            for line in file:
+
+                if line.strip():
+
+                    entry = json.loads(line)
+
+                    self.tapes.setdefault(self.key(entry['method'], entry['url'], entry['params'], entry['data']),
+                                          []).append(entry)
+
+    def record(self, method: str, url: str, params: dict, data: dict, page: requests.Response):
+        # append a request and its response to the cassette
+
+        body = page.text
+
+        # do not keep issued access tokens around
+        if url.endswith("/auth/access") and page.ok:
+
+            body = json.dumps({**page.json(), 'accessToken': "recorded"})
+
+        entry = {'time': time.time(), 'method': method, 'url': url,
+                 'params': {field: value for field, value in (params or {}).items() if field not in SECRET_FIELDS},
+                 'data': {field: value for field, value in (data or {}).items() if field not in SECRET_FIELDS},
+                 'status': page.status_code, 'headers': dict(page.headers), 'body': body}
+
+        with self.lock:
+
+            with open(self.path, "a", encoding='utf-8') as file:
+
+                file.write(json.dumps(entry) + "\n")
+
+    def replay(self, method: str, url: str, params: dict = None, data: dict = None):
+        # build the recorded response for a request
+        # repeats of a request get the next recording and the last one is reused once they run out
+
+        with self.lock:
+
+            tape = self.tapes.get(self.key(method, url, params, data))
+
+            if not tape:
+
+                logging.info(f"{method} {url} is not in the cassette")
+                entry = {'status': 404, 'headers': {}, 'body': json.dumps({'message': "Not in cassette"})}
+
+            else:
+
+                entry = tape.pop(0) if len(tape) > 1 else tape[0]
+
+        page = requests.Response()
+        page.status_code = entry['status']
+        page.headers = CaseInsensitiveDict(entry['headers'])
+        page.url = url
+        page.encoding = 'utf-8'
+        page.reason = "Replayed"
+
+        # mark the body as already read so iter_content streams it from memory
+        page._content = entry['body'].encode()
+        page._content_consumed = True
+
+        return page
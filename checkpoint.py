@@ -0,0 +1,96 @@
+import threading
+import tempfile
+import json
+import time
+import os
+
+
+class Checkpoint:
+
+    def __init__(self, path: str = "kit_flips.checkpoint.jsonl", freshness: float = 6 * 60 * 60):
+
+        # the append only file every refined weapon is written to as soon as it is done
+        self.path = path
+
+        # how many seconds a refined weapon is trusted for before it is refined again
+        self.freshness = freshness
+
+        # (weapon, quality) to the latest entry written for it
+        self.entries = {}
+
+        self.lock = threading.Lock()
+
+        self.load()
+
+    def load(self):
+
+        try:
+
+            with open(self.path, encoding='utf-8') as file:
+
+                for line in file:
+
+                    # a crash mid write can leave a cut off last line
+                    try:
+
+                        entry = json.loads(line)
+
+                    except json.JSONDecodeError:
+
+                        continue
+
+                    self.entries[(entry['weapon'], entry['quality'])] = entry
+
+        except FileNotFoundError:
+
+            pass
+
+    def is_fresh(self, weapon: str, quality: str = ""):
+        # check if a weapon was refined recently enough to skip it
+
+        # failed refines are never fresh so an old checkpoint holding them is retried too
+        entry = self.entries.get((weapon, quality))
+
+        return entry is not None and entry['profit'] is not None and time.time() - entry['time'] < self.freshness
+
+    def profit(self, weapon: str, quality: str = ""):
+
+        return self.entries[(weapon, quality)]['profit']
+
+    def write(self, weapon: str, quality: str, profit: float | None):
+        # durably record a refined weapon before moving on
+
+        entry = {'weapon': weapon, 'quality': quality, 'profit': profit, 'time': time.time()}
+
+        with self.lock:
+
+            with open(self.path, "a", encoding='utf-8') as file:
+
+                file.write(json.dumps(entry) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+
+            self.entries[(weapon, quality)] = entry
+
+
+def save_json(path: str, data):
+    # replace a json file in one step so a crash never leaves it half written
+    # each save writes its own temp file so processes saving the same file never trip over each other
+
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".",
+                                         suffix=".tmp")
+
+    try:
+
+        with os.fdopen(handle, "w", encoding='utf-8') as file:
+
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temp_path, path)
+
+    except BaseException:
+
+        os.unlink(temp_path)
+        raise
@@ -0,0 +1,209 @@
+import argparse
+import logging
+import json
+import sys
+
+
+# everything past the standard library is imported inside the command that needs it
+# so quick commands like flips never load requests or build a PriceGrabber
+
+
+def make_grabber(args):
+    # build a PriceGrabber from auth.json and the shared options
+
+    from main4 import PriceGrabber
+
+    with open(args.auth) as file:
+        auth = json.load(file)
+
+    options = {}
+
+    if args.cache:
+
+        from price_cache import PriceCache
+
+        options['price_cache'] = PriceCache(args.cache)
+
+    if args.history:
+
+        from history import HistoryStore
+
+        options['history'] = HistoryStore(args.history)
+
+    grabber = PriceGrabber(token=auth['token'], api_key=auth['api_key'], **options)
+
+    if args.metrics_port:
+
+        grabber.serve_metrics(args.metrics_port)
+
+    return grabber
+
+
+def save(path: str, data):
+
+    from checkpoint import save_json
+
+    save_json(path, data)
+
+
+def price(args):
+    # price every flip with price.tf and save them
+
+    flips = make_grabber(args).price_ks_flips(quality=args.quality, max_workers=args.workers, bulk=args.bulk)
+
+    save(args.out, flips)
+
+
+def sweep(args):
+    # price every quality and killstreak tier in one pass and save the ranked table
+
+    table = make_grabber(args).sweep_ks_flips(qualities=tuple(args.qualities), tiers=tuple(args.tiers),
+                                              max_workers=args.workers, bulk=args.bulk)
+
+    save(args.out, table)
+
+
+def refine(args):
+    # check the saved flips against backpack.tf listings
+
+    from checkpoint import Checkpoint
+
+    with open(args.flips, encoding='utf-8') as file:
+        flips = json.load(file)
+
+    checkpoint = Checkpoint(args.checkpoint, freshness=args.freshness) if args.checkpoint else None
+
+    flips = make_grabber(args).refine_ks_flips(flips, quality=args.quality, depth=args.depth, checkpoint=checkpoint,
+                                               threshold=args.threshold, top_n=args.top_n)
+
+    save(args.out or args.flips, flips)
+
+
+def watch(args):
+    # keep the flip table up to date until stopped
+
+    from watch import FlipWatcher, publish_json
+
+    watcher = FlipWatcher(make_grabber(args), quality=args.quality, interval=args.interval,
+                          refine_top=args.refine_top, publish=publish_json(args.out) if args.out else None)
+
+    watcher.run(cycles=args.cycles)
+
+
+def bench(args):
+
+    import bench as benchmark
+
+    benchmark.main(args.bench_args)
+
+
+def flips(args):
+    # print the best saved flips without touching the network
+
+    with open(args.flips, encoding='utf-8') as file:
+        saved = json.load(file)
+
+    # kit_flips.json maps weapons to profits while a sweep saves a list of rows
+    if isinstance(saved, dict):
+
+        rows = [(weapon, profit) for weapon, profit in saved.items()]
+
+    else:
+
+        rows = [(" ".join(part for part in (row['quality'], row['tier'], row['weapon']) if part), row['profit'])
+                for row in saved]
+
+    rows.sort(reverse=True, key=lambda row: (row[1] is not None, row[1] or 0))
+
+    for name, profit in rows[:args.top]:
+
+        print(f"{name:<48} {profit}")
+
+
+def parser():
+
+    cli = argparse.ArgumentParser(prog="tf2trade", description="Find profitable killstreak kit flips")
+    cli.add_argument("-v", "--verbose", action="store_true", help="log progress")
+
+    commands = cli.add_subparsers(dest="command", required=True)
+
+    # the options of every command that talks to price.tf or backpack.tf
+    network = argparse.ArgumentParser(add_help=False)
+    network.add_argument("--auth", default="auth.json", help="json file with the backpack.tf token and api key")
+    network.add_argument("--cache", help="keep price.tf prices in this sqlite file between runs")
+    network.add_argument("--history", help="append every price and snapshot to a history store in this directory")
+    network.add_argument("--metrics-port", type=int, help="serve prometheus metrics on this port")
+
+    command = commands.add_parser("price", parents=[network], help="price every flip with price.tf")
+    command.add_argument("--quality", default="")
+    command.add_argument("--workers", type=int, default=0, help="price checks in flight at once")
+    command.add_argument("--bulk", action="store_true", help="download the whole price list instead")
+    command.add_argument("--out", default="kit_flips.json")
+    command.set_defaults(run=price)
+
+    command = commands.add_parser("sweep", parents=[network], help="price every quality and tier in one pass")
+    command.add_argument("--qualities", nargs="*", default=["", "Strange"])
+    command.add_argument("--tiers", nargs="*",
+                         default=["Killstreak", "Specialized Killstreak", "Professional Killstreak"])
+    command.add_argument("--workers", type=int, default=0, help="price checks in flight at once")
+    command.add_argument("--bulk", action="store_true", help="download the whole price list instead")
+    command.add_argument("--out", default="sweep_flips.json")
+    command.set_defaults(run=sweep)
+
+    command = commands.add_parser("refine", parents=[network], help="check priced flips against backpack.tf")
+    command.add_argument("--flips", default="kit_flips.json", help="the priced flips to refine")
+    command.add_argument("--out", help="where to save the refined flips, the flips file by default")
+    command.add_argument("--quality", default="")
+    command.add_argument("--depth", type=int, default=1, help="listings deep to check each flip")
+    command.add_argument("--threshold", type=float, help="skip flips that cannot make this much")
+    command.add_argument("--top-n", type=int, help="skip flips that cannot beat the top n refined flips")
+    command.add_argument("--checkpoint", default="kit_flips.checkpoint.jsonl",
+                         help="save each refined flip here and skip fresh ones, empty to turn off")
+    command.add_argument("--freshness", type=float, default=6 * 60 * 60, help="seconds a checkpointed flip is fresh")
+    command.set_defaults(run=refine)
+
+    command = commands.add_parser("watch", parents=[network], help="keep the flip ranking up to date")
+    command.add_argument("--quality", default="")
+    command.add_argument("--interval", type=float, default=60, help="seconds between cycles")
+    command.add_argument("--refine-top", type=int, default=10, help="best flips to watch the listings of")
+    command.add_argument("--cycles", type=int, help="stop after this many cycles")
+    command.add_argument("--out", help="publish each ranking to this json file instead of printing it")
+    command.set_defaults(run=watch)
+
+    # every argument after bench is handed to bench.main
+    command = commands.add_parser("bench", help="time sweeps against local stand-in servers", add_help=False,
+                                  description="every argument is passed on to bench.py")
+    command.set_defaults(run=bench)
+
+    command = commands.add_parser("flips", help="print the best saved flips")
+    command.add_argument("--flips", default="kit_flips.json", help="saved flips from price, sweep or refine")
+    command.add_argument("--top", type=int, default=20)
+    command.set_defaults(run=flips)
+
+    return cli
+
+
+def main(argv: list = None):
+
+    cli = parser()
+
+    args, extra = cli.parse_known_args(argv)
+
+    if args.command == "bench":
+
+        args.bench_args = extra
+
+    elif extra:
+
+        cli.error(f"unrecognized arguments: {' '.join(extra)}")
+
+    if args.verbose:
+
+        logging.basicConfig(level=logging.INFO)
+
+    args.run(args)
+
+
+if __name__ == '__main__':
+
+    main(sys.argv[1:])
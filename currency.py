@@ -0,0 +1,103 @@
+import threading
+import logging
+import time
+
+
+# the sku of a mann co supply crate key
+KEY_SKU = "5021;6"
+
+# a refined metal is 9 scrap or 18 half scrap
+HALF_SCRAP_PER_REFINED = 18
+
+
+def price_half_scrap(price: dict, side: str, key_rate: float = None):
+    # the full buy or sell price of a price.tf price in half scrap
+    # price.tf splits a price into keys and half scrap and gives the key rate it used in keyHalfScrap
+
+    keys = price[f'{side}Keys'] or 0
+    half_scrap = price[f'{side}HalfScrap'] or 0
+
+    if not keys:
+
+        return half_scrap
+
+    key_rate = price[f'{side}KeyHalfScrap'] or key_rate
+
+    if key_rate is None:
+
+        raise ValueError(f"No key rate to price {keys} keys with")
+
+    return keys * key_rate + half_scrap
+
+
+class CurrencyEngine:
+
+    def __init__(self, fetch_key_price, ttl: float = 60 * 60, usd_per_key: float = None):
+
+        # returns the price.tf price of a key, ie lambda: grabber.check_price(item_sku=KEY_SKU)
+        self.fetch_key_price = fetch_key_price
+
+        # how many seconds a key rate is used for before it is looked up again
+        self.ttl = ttl
+
+        # what a key sells for in usd, usd listings are only comparable when it is set
+        self.usd_per_key = usd_per_key
+
+        # the key rate in half scrap and when it was looked up
+        self.rate = None
+        self.fetched_at = 0
+
+        # after a failed lookup without any rate to fall back on wait this long before asking price.tf again
+        # so every key listing of a snapshot does not retry it
+        self.retry_after = 60
+        self.failed_at = float('-inf')
+
+        self.lock = threading.Lock()
+
+    def key_rate(self):
+        # the half scrap a key sells for, looked up once every ttl seconds
+
+        with self.lock:
+
+            if self.rate is None and time.time() - self.failed_at < self.retry_after:
+
+                raise ValueError("Could not look up the key rate")
+
+            if self.rate is None or time.time() - self.fetched_at >= self.ttl:
+
+                key_price = self.fetch_key_price()
+
+                # keep using the old rate if price.tf could not be reached
+                if key_price is not None:
+
+                    self.rate = price_half_scrap(key_price, 'sell', self.rate)
+                    self.fetched_at = time.time()
+
+                    logging.info(f"Key rate is {self.rate} half scrap")
+
+                elif self.rate is None:
+
+                    self.failed_at = time.time()
+
+                    raise ValueError("Could not look up the key rate")
+
+            return self.rate
+
+    def half_scrap(self, keys: float = 0, metal: float = 0, usd: float = 0, key_rate: float = None):
+        # convert an amount of keys, refined metal and usd into half scrap
+        # rounded to the nearest half scrap since backpack.tf gives refined to two places ie 0.77 is 14 not 13.86
+        # returns None for usd without a usd_per_key to convert it with
+
+        if usd and self.usd_per_key is None:
+
+            return None
+
+        if keys or usd:
+
+            key_rate = key_rate if key_rate is not None else self.key_rate()
+
+            keys += usd / self.usd_per_key if usd else 0
+
+            return round(keys * key_rate + metal * HALF_SCRAP_PER_REFINED)
+
+        return round(metal * HALF_SCRAP_PER_REFINED)
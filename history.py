@@ -0,0 +1,199 @@
+from urllib.parse import quote, unquote
+from array import array
+import threading
+import bisect
+import math
+import mmap
+import time
+import os
+
+from currency import price_half_scrap
+
+
+# every column of the store, each kept as its own file of doubles per sku
+# buy and sell are price.tf's prices and bid and ask the best backpack.tf listings, all in half scrap
+COLUMNS = ("time", "buy", "sell", "bid", "ask")
+
+
+class HistoryStore:
+    # an append only history of prices and best listings kept as one file per column per sku
+    # rows are appended in time order so a range is found by bisecting the memory mapped time column
+    # and only the columns asked for are read
+
+    def __init__(self, root: str = "history"):
+
+        self.root = root
+
+        # sku to the time of its last row so rows stay in order
+        self.last_time = {}
+
+        # sku to the updatedAt of the last price recorded for it so a price seen again is not stored twice
+        self.updated_at = {}
+
+        self.lock = threading.Lock()
+
+    def path(self, item_sku: str, column: str):
+
+        return os.path.join(self.root, quote(item_sku, safe=""), f"{column}.f64")
+
+    def record(self, item_sku: str, timestamp: float = None, **values: float):
+        # append a row for a sku, columns that are not given are stored as nan
+
+        if unknown := set(values) - set(COLUMNS[1:]):
+
+            raise ValueError(f"Unknown history columns {unknown}")
+
+        with self.lock:
+
+            if item_sku not in self.last_time:
+
+                self.repair(item_sku)
+
+                times = self.read(item_sku, "time", -1, None)
+                self.last_time[item_sku] = times[0] if times else float('-inf')
+
+            # keep rows in order if the clock steps back
+            if timestamp is None:
+
+                timestamp = max(time.time(), self.last_time[item_sku])
+
+            if timestamp < self.last_time[item_sku]:
+
+                raise ValueError(f"History for {item_sku} has rows after {timestamp}")
+
+            os.makedirs(os.path.dirname(self.path(item_sku, "time")), exist_ok=True)
+
+            # write the time column last so a row cut off by a crash is never found by a query
+            for column in COLUMNS[1:] + COLUMNS[:1]:
+
+                value = timestamp if column == "time" else values.get(column)
+
+                with open(self.path(item_sku, column), "ab") as file:
+
+                    array('d', [value if value is not None else math.nan]).tofile(file)
+
+            self.last_time[item_sku] = timestamp
+
+    def repair(self, item_sku: str):
+        # cut every column back to the rows the time column has, dropping a row a crash left half written
+
+        try:
+
+            rows = os.path.getsize(self.path(item_sku, "time")) // 8
+
+        except FileNotFoundError:
+
+            rows = 0
+
+        for column in COLUMNS[1:]:
+
+            try:
+
+                if os.path.getsize(self.path(item_sku, column)) > rows * 8:
+
+                    os.truncate(self.path(item_sku, column), rows * 8)
+
+            except FileNotFoundError:
+
+                pass
+
+    def record_price(self, price: dict, timestamp: float = None):
+        # append a price.tf price unless it is the one last recorded for its sku
+
+        if self.updated_at.get(price['sku']) == price.get('updatedAt'):
+
+            return
+
+        self.updated_at[price['sku']] = price.get('updatedAt')
+
+        self.record(price['sku'], timestamp, buy=price_half_scrap(price, 'buy'), sell=price_half_scrap(price, 'sell'))
+
+    def record_listings(self, item_sku: str, best_listings, timestamp: float = None):
+        # append the best buy and sell listing of a snapshot
+
+        bid = best_listings.top('buy')
+        ask = best_listings.top('sell')
+
+        self.record(item_sku, timestamp, bid=bid['price'] if bid is not None else None,
+                    ask=ask['price'] if ask is not None else None)
+
+    def read(self, item_sku: str, column: str, start: int, stop: int | None):
+        # read rows start to stop of a column thru a memory map
+
+        try:
+
+            file = open(self.path(item_sku, column), "rb")
+
+        except FileNotFoundError:
+
+            return array('d')
+
+        with file:
+
+            if os.fstat(file.fileno()).st_size == 0:
+
+                return array('d')
+
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+
+                view = memoryview(mapped).cast('d')
+
+                try:
+
+                    return array('d', view[start:stop])
+
+                finally:
+
+                    view.release()
+
+    def span(self, item_sku: str, start: float, end: float):
+        # the row numbers of a sku's rows with start <= time < end found by bisecting the mapped time column
+
+        try:
+
+            file = open(self.path(item_sku, "time"), "rb")
+
+        except FileNotFoundError:
+
+            return 0, 0
+
+        with file:
+
+            if os.fstat(file.fileno()).st_size == 0:
+
+                return 0, 0
+
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+
+                view = memoryview(mapped).cast('d')
+
+                try:
+
+                    return bisect.bisect_left(view, start), bisect.bisect_left(view, end)
+
+                finally:
+
+                    view.release()
+
+    def query(self, item_sku: str, start: float = float('-inf'), end: float = float('inf'),
+              columns: tuple = ("time", "buy", "sell")):
+        # the given columns of a sku's rows between start and end, each as an array of doubles
+
+        if unknown := set(columns) - set(COLUMNS):
+
+            raise ValueError(f"Unknown history columns {unknown}")
+
+        first, last = self.span(item_sku, start, end)
+
+        return {column: self.read(item_sku, column, first, last) for column in columns}
+
+    def skus(self):
+        # every sku with history
+
+        try:
+
+            return [unquote(entry.name) for entry in os.scandir(self.root) if entry.is_dir()]
+
+        except FileNotFoundError:
+
+            return []
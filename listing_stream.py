@@ -0,0 +1,351 @@
+import codecs
+import heapq
+import json
+import logging
+
+
+# decodes one json value from the front of a string without needing the rest of the document
+decoder = json.JSONDecoder()
+
+WHITESPACE = " \t\n\r"
+NUMBER_CHARACTERS = "0123456789.eE+-"
+
+
+class SnapshotStream:
+
+    def __init__(self, chunks, array_key: str = "listings"):
+
+        # the raw byte chunks of the response ie page.iter_content()
+        self.chunks = iter(chunks)
+
+        # the key of the array whose items are yielded one by one
+        self.array_key = array_key
+
+        # every other top level field of the response ie "sku"
+        self.fields = {}
+
+        self.text = ""
+        self.pos = 0
+        self.done = False
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+
+    def read(self):
+        # pull the next chunk into the buffer, returns False when the stream has ended
+
+        if self.done:
+
+            return False
+
+        # drop what has already been decoded so the buffer only holds the value being decoded
+        self.text = self.text[self.pos:]
+        self.pos = 0
+
+        try:
+
+            self.text += self.utf8.decode(next(self.chunks))
+
+        except StopIteration:
+
+            self.text += self.utf8.decode(b"", final=True)
+            self.done = True
+
+        return True
+
+    def skip(self, characters: str = WHITESPACE):
+        # move past any of the characters, returns the next other character or None if the stream ended
+
+        while True:
+
+            while self.pos < len(self.text) and self.text[self.pos] in characters:
+
+                self.pos += 1
+
+            if self.pos < len(self.text):
+
+                return self.text[self.pos]
+
+            if not self.read():
+
+                return None
+
+    def expect(self, character: str):
+
+        if self.skip() != character:
+
+            raise json.JSONDecodeError(f"Expecting '{character}'", self.text, self.pos)
+
+        self.pos += 1
+
+    def decode(self):
+        # decode the next json value, reading more chunks until it is complete
+
+        self.skip()
+
+        while True:
+
+            try:
+
+                value, end = decoder.raw_decode(self.text, self.pos)
+
+                # a number cut off by the end of the buffer may continue in the next chunk ie "0." or "12e"
+                if (self.done or isinstance(value, (dict, list, str))
+                        or (end < len(self.text) and self.text[end] not in NUMBER_CHARACTERS)):
+
+                    self.pos = end
+                    return value
+
+            except json.JSONDecodeError:
+
+                if self.done:
+
+                    raise
+
+            self.read()
+
+    def __iter__(self):
+        # yield the items of the array one at a time while filling in the other fields
+
+        self.expect("{")
+
+        while (character := self.skip(WHITESPACE + ",")) != "}":
+
+            if character is None:
+
+                raise json.JSONDecodeError("Unterminated object", self.text, self.pos)
+
+            key = self.decode()
+            self.expect(":")
+
+            # stream the items of the array we want
+            if key == self.array_key and self.skip() == "[":
+
+                self.pos += 1
+
+                while (character := self.skip(WHITESPACE + ",")) != "]":
+
+                    if character is None:
+
+                        raise json.JSONDecodeError("Unterminated array", self.text, self.pos)
+
+                    yield self.decode()
+
+                self.pos += 1
+
+                # mark that the array was there even though its items were not kept
+                self.fields[key] = None
+
+            # and keep every other field whole
+            else:
+
+                self.fields[key] = self.decode()
+
+        self.pos += 1
+
+
+class Listing:
+    # the parts of a backpack.tf listing the filters and profit math use, built once when it is read
+    # attributes are kept as a frozenset of defindexes so filtering is a set check
+    # keys, metal and usd are the listing's currencies, price is backpack.tf's value or half scrap once normalized
+
+    __slots__ = ('id', 'steamid', 'intent', 'price', 'keys', 'metal', 'usd', 'attributes')
+
+    def __init__(self, id: str, steamid: str, intent: str, price: float, keys: float, metal: float, usd: float,
+                 attributes: frozenset):
+
+        self.id = id
+        self.steamid = steamid
+        self.intent = intent
+        self.price = price
+        self.keys = keys
+        self.metal = metal
+        self.usd = usd
+        self.attributes = attributes
+
+    @classmethod
+    def from_json(cls, listing: dict):
+        # snapshot listings carry a price and feed listings carry their value
+
+        price = listing['price'] if 'price' in listing else listing['value']['raw']
+
+        currencies = listing.get('currencies', {})
+
+        return cls(listing.get('id'), listing.get('steamid'), listing.get('intent'), price,
+                   currencies.get('keys', 0), currencies.get('metal', 0), currencies.get('usd', 0),
+                   frozenset(int(attribute['defindex']) for attribute in listing['item'].get('attributes', ())))
+
+    def __getitem__(self, field: str):
+        # let listings be read like the json they came from ie listing['price']
+
+        try:
+
+            return getattr(self, field)
+
+        except AttributeError:
+
+            raise KeyError(field)
+
+    def __repr__(self):
+
+        return f"Listing({self.id!r}, {self.intent!r}, {self.price!r})"
+
+
+class BestListings:
+
+    def __init__(self, banned_attributes: tuple = (), k: int = 1, currency=None, key_rate: float = None):
+
+        self.banned_attributes = set(banned_attributes)
+
+        # if given a CurrencyEngine listings are priced in half scrap from their currencies
+        # with one key rate for the whole snapshot, otherwise usd listings are dropped
+        # the key rate is looked up at the first key listing unless it is given
+        self.currency = currency
+        self.key_rate = key_rate
+
+        # how many of the best listings of each intent to keep
+        self.k = k
+
+        # the k cheapest sell listings and k highest buy listings seen so far
+        # each heap keeps its worst listing on top so it can be swapped out in O(log k)
+        # sell entries are (-price, -order, listing) and buy entries are (price, order, listing)
+        # so ties go the same way the old sorted(...)[0] and sorted(...)[-1] picks did
+        self.heaps = {'sell': [], 'buy': []}
+
+        # how many listings were looked at
+        self.count = 0
+
+    def add(self, listing: dict | Listing):
+        # check a listing against the filters and keep it if it is among the k best of its intent
+
+        self.count += 1
+
+        if not isinstance(listing, Listing):
+
+            listing = Listing.from_json(listing)
+
+        intent = listing.intent
+
+        if intent not in self.heaps:
+
+            return
+
+        # if the listing has any banned attributes
+        if not self.banned_attributes.isdisjoint(listing.attributes):
+
+            return
+
+        if self.currency is not None:
+
+            if self.key_rate is None and (listing.keys or listing.usd):
+
+                # without a key rate drop the key and usd listings but keep pricing the metal ones
+                try:
+
+                    self.key_rate = self.currency.key_rate()
+
+                except ValueError as error:
+
+                    logging.info(f"{listing} is in keys: {error}")
+
+                    return
+
+            listing.price = self.currency.half_scrap(listing.keys, listing.metal, listing.usd, self.key_rate)
+
+        # or if the listing is in usd we cannot convert
+        if listing.usd and (self.currency is None or listing.price is None):
+
+            logging.info(f"{listing} is in usd")
+
+            return
+
+        # sell listings are best when cheapest and buy listings when most profitable
+        if intent == 'sell':
+
+            entry = (-listing.price, -self.count, listing)
+
+        else:
+
+            entry = (listing.price, self.count, listing)
+
+        heap = self.heaps[intent]
+
+        if len(heap) < self.k:
+
+            heapq.heappush(heap, entry)
+
+        # if it beats the worst listing we are keeping swap them
+        elif entry > heap[0]:
+
+            heapq.heapreplace(heap, entry)
+
+    def extend(self, listings):
+
+        for listing in listings:
+
+            self.add(listing)
+
+        return self
+
+    def top_k(self, intent: str):
+        # the kept listings for an intent best first
+
+        return [entry[2] for entry in sorted(self.heaps[intent], reverse=True)]
+
+    def top(self, intent: str):
+        # the best listing for an intent or None if no listing passed the filters
+
+        heap = self.heaps[intent]
+
+        if not heap:
+
+            return None
+
+        return max(heap)[2]
+
+    def depth(self, intent: str):
+        # the kept listings as price levels best first
+        # each level has the quantity and total price of buying or selling down to it
+
+        levels = []
+
+        quantity = 0
+        cost = 0
+
+        for listing in self.top_k(intent):
+
+            quantity += 1
+            cost += listing['price']
+
+            if levels and levels[-1]['price'] == listing['price']:
+
+                levels[-1].update(quantity=quantity, cost=cost)
+
+            else:
+
+                levels.append({'price': listing['price'], 'quantity': quantity, 'cost': cost})
+
+        return levels
+
+
+def select_listings(listings, intent: str, k: int = 1, banned_attributes: tuple = ()):
+    # the k best listings for an intent in a single pass over a snapshot
+
+    return BestListings(banned_attributes, k=k).extend(listings).top_k(intent)
+
+
+def executable_flips(kit_listings: list, weapon_listings: list):
+    # pair the cheapest kit sell listings with the highest weapon buy listings
+    # and count how many flips in a row still make a profit and how much they make in total
+
+    units = 0
+    profit = 0
+
+    for kit_listing, weapon_listing in zip(kit_listings, weapon_listings):
+
+        if weapon_listing['price'] - kit_listing['price'] <= 0:
+
+            break
+
+        units += 1
+        profit += weapon_listing['price'] - kit_listing['price']
+
+    return units, profit
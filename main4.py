@@ -1,28 +1,285 @@
-import requests
-import sku.parser
 from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import heapq
+import asyncio
 import time
 import json
 import logging
 
+import requests
+
+from price_cache import PriceCache
+from transport import Transport
+from snapshot_scheduler import SnapshotScheduler
+from listing_stream import SnapshotStream, BestListings, executable_flips
+from sku_table import SkuTable, weapon_name, kit_name, QUALITIES, KILLSTREAK_TIERS
+from retry import RetryPolicy
+from price_token import TokenManager, TokenRequestFailed
+from metrics import Metrics
+from checkpoint import Checkpoint, save_json
+from order_book import OrderBook
+from currency import CurrencyEngine, KEY_SKU, price_half_scrap
+from refresh_queue import RefreshQueue
+from history import HistoryStore
+
+
+# where the price.tf and backpack.tf apis live
+PRICES_URL = "https://api2.prices.tf"
+BACKPACK_URL = "https://backpack.tf/api"
+
+
+def holding_refreshes(method):
+    # hold the refresh queue while a sweep runs so the refreshes it queues are sent by how much they matter
+    # once it has prioritized them rather than in the order they were found
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+
+        self.refresh_queue.hold()
+
+        try:
+
+            return method(self, *args, **kwargs)
+
+        finally:
+
+            self.refresh_queue.release()
+
+    return wrapper
+
 
 class PriceGrabber:
 
-    def __init__(self, token: str, api_key: str, days_until_old: float = 5):
+    def __init__(self, token: str | list, api_key: str, days_until_old: float = 5, price_cache: PriceCache = None,
+                 sku_table: SkuTable = None, transport: Transport = None,
+                 snapshot_scheduler: SnapshotScheduler = None, retry_policy: RetryPolicy = None,
+                 price_token: TokenManager = None, prices_url: str = PRICES_URL, backpack_url: str = BACKPACK_URL,
+                 metrics: Metrics = None, order_book: OrderBook = None, currency: CurrencyEngine = None,
+                 refresh_queue: RefreshQueue = None, history: HistoryStore = None):
 
         # load the necessary secrets
-        self.token = token
+        # token may be a list of backpack.tf tokens to spread snapshot requests over
+        self.tokens = [token] if isinstance(token, str) else list(token)
+        self.token = self.tokens[0]
         self.api_key = api_key
 
-        # start up communication with price.tf and load the date to check accuracy
+        # the api base urls, pointed elsewhere for testing
+        self.prices_url = prices_url
+        self.backpack_url = backpack_url
+
+        # latency, response, retry, wait and cache counters for the whole grabber
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        # every request to price.tf and backpack.tf goes thru the pooled keep alive connections
+        self.transport = transport if transport is not None else Transport()
+
+        # how failed requests are retried and when a host is treated as down
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
 
-        self.price_auth_token = requests.post("https://api2.prices.tf/auth/access").json()["accessToken"]
+        # keep backpack.tf snapshot requests within its limits and reuse snapshots it still has cached
+        self.snapshot_scheduler = snapshot_scheduler if snapshot_scheduler is not None else SnapshotScheduler()
+
+        for backpack_token in self.tokens:
+
+            self.snapshot_scheduler.add_token(backpack_token)
+
+        # report to our metrics from any part that is not already reporting elsewhere
+        for part in (self.transport, self.retry_policy, self.snapshot_scheduler):
+
+            if part.metrics is None:
+
+                part.metrics = self.metrics
+
+        # load the date to check accuracy
+
+        # the price.tf token is reused from the last run while it is valid and refreshed before it lapses
+        # it is only requested once a price.tf call needs it so commands that never reach price.tf start quickly
+        # a token replayed from a cassette is fake so it is never saved for a live run to trust
+        cassette = getattr(self.transport, 'cassette', None)
+
+        self.price_token = (price_token if price_token is not None
+                            else TokenManager(self.transport, url=f"{prices_url}/auth/access",
+                                              retry_policy=self.retry_policy, host=prices_url,
+                                              wait=self.wait_for_price_retry, back_off=self.back_off_prices,
+                                              persist=cassette is None or cassette.mode != "replay"))
 
         self.today = date.today()
         self.days_until_old = days_until_old
 
-        # record the last time backpack.tf snapshot was accessed
-        self.last_bp_sc = 0
+        # optional on disk cache of price.tf prices so fresh prices are not requested again
+        self.price_cache = price_cache
+
+        # the full price.tf price list indexed by sku once load_price_index is called
+        self.price_index = None
+
+        # (flip, quality) to the price.tf upper bound on its profit, filled in as flips are priced
+        self.upper_bounds = {}
+
+        # load the precomputed name to sku table for the weapon universe
+        self.sku_table = sku_table if sku_table is not None else SkuTable()
+
+        # outdated and unpriced skus are refreshed in the background within a small share of the price.tf budget
+        self.refresh_queue = refresh_queue if refresh_queue is not None else RefreshQueue(self.request_price_update)
+
+        # optional store every fetched price and snapshot's best listings are appended to
+        self.history = history
+
+        # prices listings in half scrap from their keys, metal and usd with a cached key rate
+        self.currency = (currency if currency is not None
+                         else CurrencyEngine(lambda: self.check_price(item_sku=KEY_SKU, rq_update=False)))
+
+        # optional live order book fed by the backpack.tf listing feed
+        # items it holds are answered from memory instead of a snapshot
+        self.order_book = order_book
+
+        # rank the book in half scrap like snapshots unless it was given its own currency engine
+        if self.order_book is not None and self.order_book.currency is None:
+
+            self.order_book.currency = self.currency
+
+        # record when price.tf will accept requests again after a 429
+        # shared by every worker so one throttled request pauses all of them
+        self.price_retry_at = 0
+
+    def wait_for_price_retry(self):
+        # block until any price.tf backoff has passed
+
+        while (time_till_retry := self.price_retry_at - time.time()) > 0:
+
+            self.metrics.sleep("price.tf retry-after", time_till_retry)
+
+    def back_off_prices(self, seconds: float):
+        # push back the shared retry time so every worker waits on it
+
+        self.price_retry_at = max(self.price_retry_at, time.time() + seconds)
+
+    def serve_metrics(self, port: int = 9100):
+        # export the metrics in the prometheus text format at http://127.0.0.1:port/metrics
+
+        return self.metrics.serve(port)
+
+    def is_outdated(self, price: dict):
+        # check if a price.tf price is over the set acceptable days old
+
+        return self.today > date.fromisoformat(price["updatedAt"][:10]) + timedelta(days=self.days_until_old)
+
+    def request_price_update(self, item_sku: str):
+        # ask price.tf to reprice an item, returns True if it was accepted
+        # called by the refresh queue, check_price only queues skus
+
+        self.wait_for_price_retry()
+
+        page = self.transport.post(f"{self.prices_url}/prices/{item_sku.replace(';', '%3B')}/refresh",
+                                   headers={"Authorization": f"Bearer {self.price_token.get()}"})
+
+        if page.status_code == 429:
+
+            self.back_off_prices(int(page.headers['retry-after'])/1000)
+
+        return page.ok
+
+    def prioritize_refresh(self, profit: float, *prices: dict):
+        # move the queued refreshes of a flip's prices up by how much a stale price could swing its margin
+        # a big price next to a thin margin is the most likely to turn a flip around
+
+        for price in prices:
+
+            if price is not None and profit is not None:
+
+                self.refresh_queue.bump(price['sku'], price_half_scrap(price, 'sell') / (abs(profit) + 1))
+
+    def load_price_index(self, page_size: int = 100, retries: int = None):
+        # download the whole price.tf price list page by page and index it by sku
+        # check_price will then answer from the index instead of requesting each sku
+
+        price_index = {}
+
+        page_number = 1
+        total_pages = 1
+
+        while page_number <= total_pages:
+
+            response = None
+
+            for _ in (retry := self.retry_policy.begin(self.prices_url, retries)):
+
+                self.wait_for_price_retry()
+
+                try:
+
+                    token = self.price_token.get()
+
+                    page = self.transport.get(f"{self.prices_url}/prices",
+                                              params={'page': page_number, 'limit': page_size},
+                                              headers={"Authorization": f"Bearer {token}"})
+
+                # if price.tf would not give us a token, the token request already counted towards the breaker
+                except TokenRequestFailed as error:
+
+                    logging.info(f"Price list failed on page {page_number}: {error}")
+                    retry.failed(trip=False)
+
+                    continue
+
+                # if we could not reach price.tf
+                except requests.RequestException as error:
+
+                    logging.info(f"Price list failed on page {page_number}: {error}")
+                    retry.failed()
+
+                    continue
+
+                match page.status_code:
+
+                    # if the page loads successfully
+                    case 200:
+
+                        retry.succeeded()
+                        response = page.json()
+
+                        break
+
+                    # if Error: Unauthorized
+                    case 401:
+
+                        logging.info("Auth faded")
+                        self.price_token.invalidate(token)
+
+                        retry.failed(trip=False)
+
+                    # if Error: Too Many Requests
+                    case 429:
+
+                        print(f"Too many requests waiting for {int(page.headers['retry-after'])/1000} seconds")
+
+                        self.back_off_prices(int(page.headers['retry-after'])/1000)
+
+                        retry.failed(retry_after=int(page.headers['retry-after'])/1000, trip=False)
+
+                    # if the page fails for some other reason
+                    case _:
+
+                        logging.info(f"Error {page.status_code}: Price list failed on page {page_number}")
+                        retry.failed(trip=page.status_code >= 500)
+
+            # if we are out of retries leave the index as it was
+            if response is None:
+
+                return None
+
+            for price in response['items']:
+
+                price_index[price['sku']] = price
+
+            # move on to the next page
+            total_pages = response['meta']['totalPages']
+            page_number += 1
+
+        logging.info(f"Indexed {len(price_index)} prices from {total_pages} pages")
+
+        self.price_index = price_index
+        return price_index
 
     def check_price(self, name: str = None, item_sku: str = None, retries: int = 3, rq_update: bool = True):
 
@@ -30,297 +287,670 @@ class PriceGrabber:
         if name:
 
             # convert name to a sku
-            item_sku = sku.parser.Sku.name_to_sku(name)
+            item_sku = self.sku_table.lookup(name)
 
-        # request a price check from price.tf
-        # supply the reformatted sku and the auth token
-        page = requests.get("https://api2.prices.tf/prices/" + item_sku.replace(';', '%3B'),
-                            headers={"Authorization": f"Bearer {self.price_auth_token}"})
+        # if we have the full price list answer from it
+        # skus missing from it fall thru to a normal lookup so they are still requested to be priced
+        if self.price_index is not None and item_sku in self.price_index:
 
-        match page.status_code:
+            price = self.price_index[item_sku]
 
-            # if the page loads successfully
-            case 200:
+            if self.history is not None:
 
-                # get the price json
-                price = page.json()
+                self.history.record_price(price)
 
-                # if we can request an update and if the query is over the set acceptable days old
-                if (rq_update and self.today > date.fromisoformat(price["updatedAt"][:10])
-                        + timedelta(days=self.days_until_old)):
+            if rq_update and self.is_outdated(price):
 
-                    # request an update
-                    requests.post('https://api2.prices.tf/prices/{0}/refresh'.format(item_sku.replace(';', '%3B')),
-                                  headers={"Authorization": f"Bearer {self.price_auth_token}"})
+                self.refresh_queue.push(item_sku)
 
-                    logging.info(f"Requested price update on {name}")
+            return price
 
-            # if Error: Unauthorized
-            case 401:
+        # if we have a cache and it holds a price that is not too old use it
+        if self.price_cache is not None:
 
-                logging.info("Auth faded")
-                self.price_auth_token = requests.post("https://api2.prices.tf/auth/access").json()["accessToken"]
+            price = self.price_cache.get(item_sku, oldest=self.today - timedelta(days=self.days_until_old))
 
-            # if our item is not priced
-            case 404:
+            self.metrics.count_cache("price", price is not None)
 
-                # print(f"Item price for {name} not found. Requesting price check")
+            if price is not None:
 
-                # request for it to be priced
-                requests.post(f"https://api2.prices.tf/prices/{item_sku.replace(';', '%3B')}/refresh",
-                              headers={"Authorization": f"Bearer {self.price_auth_token}"})
+                if self.history is not None:
 
-                # do not try to price it again rn
-                retries = 0
+                    self.history.record_price(price)
 
-            # if Error: Too Many Requests
-            case 429:
+                return price
 
-                print(f"Too many requests waiting for {int(page.headers['retry-after'])/1000} seconds")
+        for _ in (retry := self.retry_policy.begin(self.prices_url, retries)):
 
-                time.sleep(int(page.headers['retry-after'])/1000)
+            # do not hit price.tf while it has asked us to back off
+            self.wait_for_price_retry()
 
-            # if the page fails for some other reason
-            case _:
+            try:
 
-                logging.info(f"Error {page.status_code}: Price check failed on {name} with an sku of {item_sku}")
+                # request a price check from price.tf
+                # supply the reformatted sku and the auth token
+                token = self.price_token.get()
 
-        # if the page fails to load
-        if not page.ok:
+                page = self.transport.get(f"{self.prices_url}/prices/" + item_sku.replace(';', '%3B'),
+                                          headers={"Authorization": f"Bearer {token}"})
 
-            # if we have reloading retries left
-            if retries:
+            # if price.tf would not give us a token, the token request already counted towards the breaker
+            except TokenRequestFailed as error:
 
-                # print("Retrying")
+                logging.info(f"Price check failed on {name} with an sku of {item_sku}: {error}")
+                retry.failed(trip=False)
 
-                # retry loading the page
-                return self.check_price(name=name, item_sku=item_sku, retries=retries - 1, rq_update=rq_update)
+                continue
 
-            # if we do not have any retries left
-            else:
+            # if we could not reach price.tf
+            except requests.RequestException as error:
 
-                return None
+                logging.info(f"Price check failed on {name} with an sku of {item_sku}: {error}")
+                retry.failed()
 
-        # if the page loaded successfully
-        else:
+                continue
 
-            return price
+            match page.status_code:
+
+                # if the page loads successfully
+                case 200:
+
+                    retry.succeeded()
+
+                    # get the price json
+                    price = page.json()
+
+                    # save it for the next run
+                    if self.price_cache is not None:
+
+                        self.price_cache.put(item_sku, price)
+
+                    if self.history is not None:
 
-    def grab_listings(self, item_name: str, retries: int = 3, fails: int = 0):
+                        self.history.record_price(price)
+
+                    # if we can request an update and if the query is over the set acceptable days old
+                    if rq_update and self.is_outdated(price):
+
+                        # queue an update
+                        self.refresh_queue.push(item_sku)
+
+                    return price
+
+                # if Error: Unauthorized
+                case 401:
+
+                    logging.info("Auth faded")
+                    self.price_token.invalidate(token)
+
+                    retry.failed(trip=False)
+
+                # if our item is not priced
+                case 404:
+
+                    retry.succeeded()
+
+                    # print(f"Item price for {name} not found. Requesting price check")
+
+                    # queue it to be priced
+                    self.refresh_queue.push(item_sku)
+
+                    # do not try to price it again rn
+                    return None
+
+                # if Error: Too Many Requests
+                case 429:
+
+                    print(f"Too many requests waiting for {int(page.headers['retry-after'])/1000} seconds")
+
+                    # push back the shared retry time so every worker waits on it
+                    self.back_off_prices(int(page.headers['retry-after'])/1000)
+
+                    retry.failed(retry_after=int(page.headers['retry-after'])/1000, trip=False)
+
+                # if the page fails for some other reason
+                case _:
+
+                    logging.info(f"Error {page.status_code}: Price check failed on {name} with an sku of {item_sku}")
+
+                    # only server errors mean price.tf is having trouble
+                    retry.failed(trip=page.status_code >= 500)
+
+        # if we do not have any retries left
+        return None
+
+    def grab_listings(self, item_name: str, banned_attributes: tuple = (), k: int = 1, retries: int = None):
+        # stream an item's snapshot from backpack.tf keeping only the k best listings that pass the filters
 
         print(item_name)
 
-        # wait until backpack.tf un-cashes the listings
+        banned_attributes = tuple(banned_attributes)
 
-        if (time_till_un_cash := (self.last_bp_sc + 60) - time.time()) > 0:  # if we have to wait
+        # the live order book is newer than any snapshot so answer from it first when it holds the item
+        if self.order_book is not None and self.order_book.covers(item_name, banned_attributes):
 
-            print(f"Too many requests: Cannot request for {int(time_till_un_cash)} seconds")
-            time.sleep(time_till_un_cash)
+            return self.order_book.best_listings(item_name, k=k)
 
-        # make a request to the backpack.tf API
-        page = requests.get("https://backpack.tf/api/classifieds/listings/snapshot",
-                            data={'sku': item_name, 'appid': '440', 'token': self.token})
+        # if backpack.tf would hand back the same snapshot we already have reuse it
+        is_cached = self.snapshot_scheduler.is_cached((item_name, banned_attributes, k))
 
-        # update the time btw API calls
-        self.last_bp_sc = time.time()
+        self.metrics.count_cache("snapshot", is_cached)
 
-        match page.status_code:
+        if is_cached:
 
-            # if the request is successful
-            case 200:
+            return self.snapshot_scheduler.cached((item_name, banned_attributes, k))
 
-                # get the response payload
-                response = page.json()
+        # look up the key rate before spending a snapshot request
+        # so price.tf being down is not taken for a failed snapshot
+        # without one only the metal listings are priced
+        try:
 
-            # if Error: Too many requests
-            case 429:
+            key_rate = self.currency.key_rate()
 
-                # dump info
-                print(page)
-                print(page.content)
-                print(page.reason)
-                print(page.text)
+        except ValueError as error:
 
-                # wait the retry after length
-                print(f"Too many requests waiting for {int(page.headers['retry-after'])} seconds")
+            print(f"Pricing only metal listings of {item_name}: {error}")
 
-                # FYI the retry-after header is always returned as 6
-                time.sleep(int(page.headers['retry-after']))
+            key_rate = None
 
-            # if an unknown error occurs
-            case _:
+        for _ in (retry := self.retry_policy.begin(self.backpack_url, retries)):
 
-                # log it
-                print(f"Listing lookup failed on {item_name} with a code of {page.status_code}")
-                print(page.reason)
+            # wait until a token can fit the request in its backpack.tf budget
+            token = self.snapshot_scheduler.wait_for_budget()
 
-        # if the page failed to load
-        if not page.ok:
+            # a streamed response keeps its pooled connection until it is read to the end or closed
+            page = None
 
-            # if we have retries
-            if retries > 0:
+            try:
 
-                # retry loading
-                return self.grab_listings(item_name, retries=retries - 1, fails=fails)
+                # make a request to the backpack.tf API
+                page = self.transport.get(f"{self.backpack_url}/classifieds/listings/snapshot",
+                                          data={'sku': item_name, 'appid': '440', 'token': token}, stream=True)
 
-            # if we have no retries left
-            else:
+                if page.status_code == 200:
 
-                # give up
-                return None
+                    with page:
 
-        # if our listings are not for the correct weapon
-        if response['sku'] != item_name:
+                        # decode the listings as they arrive so the whole snapshot is never held
+                        stream = SnapshotStream(page.iter_content(chunk_size=65536))
 
-            print("Got wrong name")
+                        # unless the order book needs the whole snapshot to start the item's book
+                        if self.order_book is not None:
 
-            # try to grab the correct weapon
-            return self.grab_listings(item_name)
+                            listings = list(stream)
+                            best_listings = BestListings(banned_attributes, k=k, currency=self.currency,
+                                                         key_rate=key_rate).extend(listings)
 
-        # if we were returned the correct weapon
-        else:
+                        else:
+
+                            best_listings = BestListings(banned_attributes, k=k, currency=self.currency,
+                                                         key_rate=key_rate).extend(stream)
+
+                    # get the rest of the response payload
+                    response = stream.fields
+
+            # if we could not reach backpack.tf or the snapshot was cut off
+            except (requests.RequestException, ValueError) as error:
+
+                print(f"Listing lookup failed on {item_name}: {error}")
+                retry.failed()
+
+                if page is not None:
+
+                    page.close()
+
+                continue
+
+            match page.status_code:
+
+                # if the request is successful
+                case 200:
+
+                    retry.succeeded()
+
+                # if Error: Too many requests
+                case 429:
+
+                    # dump info
+                    print(page)
+                    print(page.content)
+                    print(page.reason)
+                    print(page.text)
+
+                    # wait the retry after length
+                    print(f"Too many requests waiting for {int(page.headers['retry-after'])} seconds")
+
+                    # FYI the retry-after header is always returned as 6
+                    # only this token is taken out of rotation, the others carry on
+                    self.snapshot_scheduler.back_off(int(page.headers['retry-after']), token)
+
+                    # the scheduler holds the request until a token is free so do not sleep out the retry-after here
+                    retry.failed(trip=False)
+
+                    continue
+
+                # if an unknown error occurs
+                case _:
+
+                    # log it
+                    print(f"Listing lookup failed on {item_name} with a code of {page.status_code}")
+                    print(page.reason)
+
+                    # the body is never read so hand the connection back
+                    page.close()
+
+                    # only server errors mean backpack.tf is having trouble
+                    retry.failed(trip=page.status_code >= 500)
+
+                    continue
 
             # check is any listings were returned
-            if "listings" in response:
+            if "listings" not in response:
 
-                return response["listings"]
+                best_listings = None
 
-            else:
+            # save the snapshot under the sku it is for so it is not requested again
+            self.snapshot_scheduler.save((response['sku'], banned_attributes, k), best_listings)
 
-                return None
+            if self.order_book is not None and best_listings is not None:
+
+                self.order_book.seed(response['sku'], listings, response.get('createdAt'))
+
+            if self.history is not None and best_listings is not None:
+
+                self.history.record_listings(self.sku_table.lookup(response['sku']), best_listings)
+
+            # if we were returned the correct weapon
+            if response['sku'] == item_name:
+
+                return best_listings
+
+            # if our listings are not for the correct weapon try to grab the correct weapon again
+            print("Got wrong name")
+
+            retry.failed(trip=False)
+
+        # if we have no retries left give up
+        return None
 
     def sort_listings(self, intent: str, item_name: str, banned_attributes: tuple = ()):
         # if the intent is 'sell' return the highest offering sell listing
         # if the intent is 'buy' return the cheapest buy listing
 
-        # load all the listings for an item
-        listings = self.grab_listings(item_name)
+        # answer from the live order book when it holds the item
+        if self.order_book is not None and self.order_book.covers(item_name, banned_attributes):
+
+            return self.order_book.best(item_name, intent)
+
+        # load the best listings for an item
+        best_listings = self.grab_listings(item_name, banned_attributes)
 
         # if we don't have listings return nothing
-        if listings is None:
+        if best_listings is None:
             return None
 
-        # create a list for any listing the fits out intent and without any banned attributes
-        valid_listings = []
+        return best_listings.top(intent)
 
-        # loop thru the listings we were provided
-        for listing in listings:
+    def top_listings(self, intent: str, item_name: str, k: int = 5, banned_attributes: tuple = ()):
+        # return the k best listings for our intent best first along with their depth
+        # the depth is the total quantity and price of taking every listing down to each price
 
-            # if the listing intent matches our intent
-            if listing['intent'] == intent:
+        best_listings = self.grab_listings(item_name, banned_attributes, k)
 
-                # and if the listing has any banned attributes by comparing each attribute with the banned ones
+        if best_listings is None:
+            return None, None
 
-                # loops thru all the attributes and creates a list
-                # if the defindex, in the attribute, is in banned attributes a True is returned
-                # if any Trues are in the list a banned attribute is detected
-                if True not in [(int(attribute['defindex']) in banned_attributes) for attribute in
-                                listing['item']['attributes']]:
+        return best_listings.top_k(intent), best_listings.depth(intent)
 
-                    # and if the listing is not in usd
-                    if 'usd' not in listing['currencies']:
+    def load_weapon_names(self):
+        # the killstreakable weapons the sku table was built from
 
-                        # add it to the valid listing
-                        valid_listings.append(listing)
+        return list(self.sku_table.weapons)
 
-                    else:
-
-                        logging.info(f"{listing['currencies']}")
+    @staticmethod
+    def calc_flip(flip: str, weapon_json: dict, kit_json: dict):
+        # work out the profit of applying a kit to a weapon from their price.tf prices
 
-        # if we have valid listings
-        if valid_listings:
+        # if either of the price check fails
+        if weapon_json is None or kit_json is None:
+            logging.info(f"Price lookup failed on {flip}")
 
-            # if we want to find sell listings
-            if intent == 'sell':
+            return None
 
-                # return the cheapest sell listing
-                return sorted(valid_listings, key=lambda x: x['price'])[0]
+        # scrape the kit and ks weapon prices counting both their keys and metal
+        kit_price = price_half_scrap(kit_json, 'sell')
+        weapon_price = price_half_scrap(weapon_json, 'buy')
 
-            # if we want to find buy listings
-            if intent == 'buy':
+        logging.info(f"Flipping {flip} grants {weapon_price - kit_price} half scrap.")
+        return weapon_price - kit_price
 
-                # return the most profitable listing
-                return sorted(valid_listings, key=lambda x: x['price'])[-1]
+    @staticmethod
+    def calc_flip_bound(weapon_json: dict, kit_json: dict):
+        # the most a flip could make, selling the weapon at price.tf's sell price after buying the kit at its buy price
 
-        # if there are no valid listings
-        else:
+        if weapon_json is None or kit_json is None:
 
             return None
 
-    def price_ks_flips(self, quality: str = ""):
+        kit_price = price_half_scrap(kit_json, 'buy')
+        weapon_price = price_half_scrap(weapon_json, 'sell')
+
+        return weapon_price - kit_price
+
+    def price_ks_bounds(self, flips, quality: str = ""):
+        # the price.tf upper bound on the profit of each flip, None if it could not be priced
+        # flips price_ks_flips already priced are not checked again
+
+        for flip in flips:
+
+            if (flip, quality) not in self.upper_bounds:
+
+                self.upper_bounds[(flip, quality)] = self.calc_flip_bound(
+                    self.check_price(item_sku=self.sku_table.weapon_sku(flip, quality)),
+                    self.check_price(item_sku=self.sku_table.kit_sku(flip, quality)))
+
+        return {flip: self.upper_bounds[(flip, quality)] for flip in flips}
+
+    @holding_refreshes
+    def price_ks_flips(self, quality: str = "", max_workers: int = 0, bulk: bool = False):
         # use price.tf to quickly get an idea of ks profitability
+        # if max_workers is set the price checks are run concurrently
+        # if bulk is set the whole price list is downloaded once instead of checking each sku
 
-        # if we have a quality append a space to the end for easy concatenation
-        if quality != "":
+        if bulk and self.price_index is None:
 
-            quality += " "
+            self.load_price_index()
 
-        with open("killstreakable_weapons_names.txt", encoding='utf-8') as file:
-            weapon_names = file.read().split("\n")
+        if max_workers:
 
-        # remove any blank lines from the list of weapons and set up the keys for our profit dict
-        flips = dict.fromkeys([weapon for weapon in weapon_names if weapon != ""])
+            return asyncio.run(self.price_ks_flips_async(quality=quality, max_workers=max_workers))
+
+        # set up the keys for our profit dict
+        flips = dict.fromkeys(self.load_weapon_names())
 
         # loop thru each weapon and find how profitable ks flipping it is
         for flip in flips:
 
             # load the prices
-            weapon_json = self.check_price(name=f"{quality} Killstreak {flip}")
-            kit_json = self.check_price(name=f"Non-Craftable {quality}Killstreak {flip} Kit")
+            weapon_json = self.check_price(item_sku=self.sku_table.weapon_sku(flip, quality))
+            kit_json = self.check_price(item_sku=self.sku_table.kit_sku(flip, quality))
 
-            # if either of the price check fails
-            if weapon_json is None or kit_json is None:
-                logging.info(f"Price lookup failed on {flip}")
+            flips[flip] = self.calc_flip(flip, weapon_json, kit_json)
+            self.upper_bounds[(flip, quality)] = self.calc_flip_bound(weapon_json, kit_json)
+            self.prioritize_refresh(flips[flip], weapon_json, kit_json)
 
-                flips[flip] = None
+        logging.info(flips)
+        return flips
 
-                continue
+    async def check_price_async(self, executor: ThreadPoolExecutor, semaphore: asyncio.Semaphore, item_sku: str):
+        # run a price check on the worker pool without blocking the event loop
+
+        async with semaphore:
+
+            # wait out any backoff before taking up a worker
+            while (time_till_retry := self.price_retry_at - time.time()) > 0:
+
+                await asyncio.sleep(time_till_retry)
+                self.metrics.add_sleep("price.tf retry-after", time_till_retry)
+
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, functools.partial(self.check_price, item_sku=item_sku))
+
+    async def price_ks_flips_async(self, quality: str = "", max_workers: int = 8):
+        # the same as price_ks_flips but with up to max_workers price checks in flight at once
+
+        flips = dict.fromkeys(self.load_weapon_names())
+
+        semaphore = asyncio.Semaphore(max_workers)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+            # fan out both lookups for every weapon
+            weapon_jsons = [self.check_price_async(executor, semaphore, self.sku_table.weapon_sku(flip, quality))
+                            for flip in flips]
+            kit_jsons = [self.check_price_async(executor, semaphore, self.sku_table.kit_sku(flip, quality))
+                         for flip in flips]
 
-            # scrape the kit and ks weapon prices
-            # TODO check this code
-            kit_price = kit_json['sellKeyHalfScrap'] if kit_json['sellKeys'] else kit_json['sellHalfScrap']
-            weapon_price = weapon_json['buyKeyHalfScrap'] if weapon_json['buyKeys'] else weapon_json['buyHalfScrap']
+            prices = await asyncio.gather(*weapon_jsons, *kit_jsons)
 
-            logging.info(f"Flipping {flip} grants {weapon_price - kit_price} half scrap.")
-            flips[flip] = weapon_price - kit_price
+        # gather keeps the order so the first half are weapons and the second are kits
+        for flip, weapon_json, kit_json in zip(flips, prices[:len(flips)], prices[len(flips):]):
+
+            flips[flip] = self.calc_flip(flip, weapon_json, kit_json)
+            self.upper_bounds[(flip, quality)] = self.calc_flip_bound(weapon_json, kit_json)
+            self.prioritize_refresh(flips[flip], weapon_json, kit_json)
 
         logging.info(flips)
         return flips
 
-    def refine_ks_flips(self, flips: dict, quality: str = ""):
+    async def check_prices_async(self, item_skus: list, max_workers: int = 8):
+        # check every sku with up to max_workers price checks in flight at once
+
+        semaphore = asyncio.Semaphore(max_workers)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+            prices = await asyncio.gather(*[self.check_price_async(executor, semaphore, item_sku)
+                                            for item_sku in item_skus])
+
+        return dict(zip(item_skus, prices))
+
+    @holding_refreshes
+    def sweep_ks_flips(self, qualities: tuple = QUALITIES, tiers: tuple = KILLSTREAK_TIERS, max_workers: int = 0,
+                       bulk: bool = False):
+        # price the flips of every quality and killstreak tier in one pass
+        # a sku shared by several flips is only checked once
+        # returns one row per flip with its weapon, quality, tier, profit and upper bound, most profitable first
+
+        if bulk and self.price_index is None:
+
+            self.load_price_index()
+
+        rows = [row for row in self.sku_table.rows if row['quality'] in qualities and row['tier'] in tiers]
+
+        item_skus = list(dict.fromkeys(item_sku for row in rows for item_sku in (row['weapon_sku'], row['kit_sku'])))
+
+        logging.info(f"Sweeping {len(rows)} flips over {len(item_skus)} skus")
+
+        if max_workers:
+
+            prices = asyncio.run(self.check_prices_async(item_skus, max_workers=max_workers))
+
+        else:
+
+            prices = {item_sku: self.check_price(item_sku=item_sku) for item_sku in item_skus}
+
+        table = []
+
+        for row in rows:
+
+            weapon_json = prices[row['weapon_sku']]
+            kit_json = prices[row['kit_sku']]
+
+            table.append({'weapon': row['weapon'], 'quality': row['quality'], 'tier': row['tier'],
+                          'profit': self.calc_flip(weapon_name(row['weapon'], row['quality'], row['tier']),
+                                                   weapon_json, kit_json),
+                          'upper_bound': self.calc_flip_bound(weapon_json, kit_json)})
+
+            self.prioritize_refresh(table[-1]['profit'], weapon_json, kit_json)
+
+            # refine_ks_flips only handles basic killstreak flips so only keep their bounds
+            if row['tier'] == "Killstreak":
+
+                self.upper_bounds[(row['weapon'], row['quality'])] = table[-1]['upper_bound']
+
+        # unpriced flips go last
+        table.sort(reverse=True, key=lambda row: (row['profit'] is not None, row['profit'] or 0))
+
+        return table
+
+    def refine_ks_flips(self, flips: dict, quality: str = "", depth: int = 1, checkpoint: Checkpoint = None,
+                        threshold: float = None, top_n: int = None, upper_bounds: dict = None):
         # loop thru all the killstreak flipping values we are given
         # and check each one for a valid kit and weapon listing
+        # if depth is over 1 also report how many flips in a row the top listings can fill
+        # with a checkpoint every refined flip is saved as it finishes and fresh ones are not refined again
+        # with a threshold or top_n flips whose price.tf upper bound cannot reach the threshold
+        # or beat the top_n-th best refined profit are not fetched and come back as None
 
         flips = self.sort_flips(flips)
 
-        # if we have a quality append a space to the end for easy concatenation
-        if quality != "":
+        # reuse the flips a previous run already refined
+        done = set()
+
+        if checkpoint is not None:
+
+            for flip in flips:
+
+                if checkpoint.is_fresh(flip, quality):
+
+                    flips[flip] = checkpoint.profit(flip, quality)
+                    done.add(flip)
+
+            logging.info(f"Reusing {len(done)} refined flips from {checkpoint.path}")
+
+        pruning = threshold is not None or top_n is not None
+
+        if pruning and upper_bounds is None:
+
+            upper_bounds = self.price_ks_bounds([flip for flip in flips if flip not in done], quality)
+
+        # min heap of the best top_n refined profits, the lowest of them is the one to beat
+        best_profits = []
 
-            quality += " "
+        def confirm(profit):
 
+            if top_n and profit is not None:
+
+                if len(best_profits) < top_n:
+
+                    heapq.heappush(best_profits, profit)
+
+                elif profit > best_profits[0]:
+
+                    heapq.heapreplace(best_profits, profit)
+
+        for flip in done:
+
+            confirm(flips[flip])
+
+        # map each snapshot we need to its flip
+        kit_names = {kit_name(flip, quality): flip for flip in flips if flip not in done}
+        weapon_names = {weapon_name(flip, quality): flip for flip in flips if flip not in done}
+
+        # queue the snapshots so the flips price.tf rates the most profitable are fetched first
+        # when pruning go by the upper bound so once one flip is pruned every flip after it is too
+        # flips that could not be priced have no bound and are never pruned
         for flip in flips:
 
-            logging.info(flip)
+            if flip in done:
+
+                continue
+
+            if pruning:
+
+                priority = upper_bounds.get(flip)
+                priority = priority if priority is not None else float('inf')
+
+            else:
+
+                priority = flips[flip] if flips[flip] is not None else float('-inf')
+
+            self.snapshot_scheduler.push(kit_name(flip, quality), priority)
+            self.snapshot_scheduler.push(weapon_name(flip, quality), priority)
 
-            kit_listing = self.sort_listings('sell', f"Non-Craftable {quality}Killstreak {flip} Kit",
-                                             banned_attributes=(1004, 1005, 1006, 1007, 1008, 1009))
-            print(kit_listing)
+        # hold the best listing of each half of a flip until the other half arrives
+        kit_listings = {}
+        weapon_listings = {}
 
-            weapon_listing = self.sort_listings('buy', f"{quality}Killstreak {flip}",
-                                                banned_attributes=(1004, 1005, 1006, 1007, 1008, 1009))
-            print(weapon_listing)
+        pruned = set()
+
+        def prune(item_name):
+            # skip a snapshot if its flip cannot beat the profit to beat
+            # a flip with one half already fetched is always finished
+
+            flip = kit_names.get(item_name, weapon_names.get(item_name))
+
+            if not pruning or flip in kit_listings or flip in weapon_listings:
+
+                return False
+
+            bound = upper_bounds.get(flip)
+
+            to_beat = max(threshold if threshold is not None else float('-inf'),
+                          best_profits[0] if top_n and len(best_profits) >= top_n else float('-inf'))
+
+            if bound is not None and bound < to_beat:
+
+                pruned.add(flip)
+                return True
+
+            return False
+
+        # fetch the snapshots without any spelled items
+        grab_listings = functools.partial(self.grab_listings, banned_attributes=(1004, 1005, 1006, 1007, 1008, 1009),
+                                          k=depth)
+
+        for item_name, best_listings in self.snapshot_scheduler.dispatch(grab_listings, skip=prune):
+
+            if item_name in kit_names:
+
+                flip = kit_names[item_name]
+
+                kit_listings[flip] = None if best_listings is None else best_listings.top_k('sell')
+                print(kit_listings[flip])
+
+            if item_name in weapon_names:
+
+                flip = weapon_names[item_name]
+
+                weapon_listings[flip] = None if best_listings is None else best_listings.top_k('buy')
+                print(weapon_listings[flip])
+
+            # wait until we have both the kit and weapon listing
+            if flip not in kit_listings or flip not in weapon_listings:
+
+                continue
+
+            logging.info(flip)
+
+            kit_listing = kit_listings.pop(flip)
+            weapon_listing = weapon_listings.pop(flip)
 
             # if either the kit of weapon listing fail
-            if kit_listing is None or weapon_listing is None:
+            if not kit_listing or not weapon_listing:
 
                 logging.info(f"Lookup failed on {flip}")
                 flips[flip] = None
 
+                # not checkpointed so the next run tries it again
                 continue
 
-            print(f"Flipping {flip} grants {weapon_listing['price'] - kit_listing['price']} scrap")
+            if depth > 1:
+
+                units, profit = executable_flips(kit_listing, weapon_listing)
+                print(f"{flip} can be flipped {units} times for {profit} half scrap")
+
+            kit_listing = kit_listing[0]
+            weapon_listing = weapon_listing[0]
+
+            print(f"Flipping {flip} grants {weapon_listing['price'] - kit_listing['price']} half scrap")
             flips[flip] = weapon_listing['price'] - kit_listing['price']
 
+            confirm(flips[flip])
+
+            if checkpoint is not None:
+
+                checkpoint.write(flip, quality, flips[flip])
+
+        if pruned:
+
+            logging.info(f"Pruned {len(pruned)} flips that could not beat the best refined profits")
+
+        for flip in pruned:
+
+            flips[flip] = None
+
         return self.sort_flips(flips)
 
     @staticmethod
@@ -349,8 +979,11 @@ if __name__ == '__main__':
 
     grabber = PriceGrabber(token=auth['token'], api_key=auth["api_key"])
 
-    with open("kit_flips.json", "r+", encoding='utf-8') as fl:
+    with open("kit_flips.json", encoding='utf-8') as fl:
+
+        kit_flips = json.load(fl)
 
-        json.dump(grabber.refine_ks_flips(json.load(fl)), fl)  # json.load(fl)
+    # a crash or ctrl-c keeps every flip refined so far for the next run
+    save_json("kit_flips.json", grabber.refine_ks_flips(kit_flips, checkpoint=Checkpoint("kit_flips.checkpoint.jsonl")))
 
     # Killstreak "Fists" kit "backpack.tf"
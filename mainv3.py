@@ -5,6 +5,8 @@ import time
 import json
 import logging
 
+from currency import CurrencyEngine, KEY_SKU
+
 
 class PriceGrabber:
 
@@ -22,6 +24,9 @@ class PriceGrabber:
         self.today = date.today()
         self.days_until_old = days_until_old
 
+        # prices listings in half scrap so they compare with the price.tf profits
+        self.currency = CurrencyEngine(lambda: self.check_price(item_sku=KEY_SKU, rq_update=False))
+
     def request_price_auth(self):
         # request and save the auth code
 
@@ -245,23 +250,42 @@ class PriceGrabber:
             print(f"No valid listings for {item_name}")
             return None
 
-    def validate_killstreak_flipping(self, profits: list, quality: str = ''):
+    def validate_killstreak_flipping(self, profits: list, quality: str = '', threshold: float = None,
+                                     top_n: int = None):
         # check the listings we have been given and refine them
         # by both returning the corrected list and printing any correct items
+        # with a threshold or top_n stop once a weapon's max profit cannot reach the threshold
+        # or beat the top_n-th best confirmed profit
 
         confirmed_profits = []
 
         if not quality == "":
             quality += " "
 
+        pruning = threshold is not None or top_n is not None
+
         # sort profits by profitability
-        profits.sort(reverse=True, key=lambda item: item[1][0])
+        # when pruning go by max profit so every weapon after the first pruned one can be skipped
+        profits.sort(reverse=True, key=lambda item: item[1][1] if pruning else item[1][0])
 
         # loop thru all given profits
         for profit in profits:
 
             weapon = profit[0]
 
+            if pruning:
+
+                best = sorted((item[1] for item in confirmed_profits), reverse=True)
+
+                to_beat = max(threshold if threshold is not None else float('-inf'),
+                              best[top_n - 1] if top_n and len(best) >= top_n else float('-inf'))
+
+                if profit[1][1] < to_beat:
+
+                    logging.info(f"Stopping at {weapon} as no weapon left can make over {to_beat}")
+
+                    break
+
             logging.info(weapon)
 
             kit_listing = self.sort_listings('sell', f"Non-Craftable {quality}Killstreak {weapon} Kit",
@@ -279,11 +303,26 @@ class PriceGrabber:
 
                 continue
 
-            print(f"Flipping {weapon} grants {weapon_listing['price'] - kit_listing['price']} scrap")
+            # convert the listings to half scrap like the price.tf profits they are pruned against
+            try:
+
+                kit_price = self.currency.half_scrap(kit_listing['currencies'].get('keys', 0),
+                                                     kit_listing['currencies'].get('metal', 0))
+                weapon_price = self.currency.half_scrap(weapon_listing['currencies'].get('keys', 0),
+                                                        weapon_listing['currencies'].get('metal', 0))
+
+            # if we could not look up the key rate
+            except ValueError as error:
+
+                logging.info(f"Lookup failed on {weapon}: {error}")
+
+                continue
+
+            print(f"Flipping {weapon} grants {weapon_price - kit_price} half scrap")
 
-            confirmed_profits.append([weapon, weapon_listing['price'] - kit_listing['price']])
+            confirmed_profits.append([weapon, weapon_price - kit_price])
 
-        confirmed_profits.sort(reverse=True, key=lambda item: item[1][0])
+        confirmed_profits.sort(reverse=True, key=lambda item: item[1])
 
         print(confirmed_profits)
 
@@ -0,0 +1,217 @@
+import http.server
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+# the upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# response codes that get their own counter, everything else is counted as "other"
+TRACKED_STATUSES = (200, 401, 404, 429)
+
+
+def endpoint(url: str):
+    # name the price.tf or backpack.tf endpoint a url or path is for
+
+    path = urlsplit(url).path.rstrip("/")
+    parts = path.split("/")
+
+    if path.endswith("/auth/access"):
+
+        return "auth"
+
+    if path.endswith("/classifieds/listings/snapshot"):
+
+        return "snapshot"
+
+    if "prices" in parts:
+
+        return ("price list", "price", "refresh")[min(len(parts) - parts.index("prices"), 3) - 1]
+
+    return "other"
+
+
+class Metrics:
+
+    def __init__(self):
+
+        # endpoint to [count per bucket..., count over the last bucket, total seconds]
+        self.latency = {}
+
+        # (endpoint, status) to count
+        self.responses = {}
+
+        # host to retries made
+        self.retries = {}
+
+        # reason to seconds spent sleeping
+        self.sleeps = {}
+
+        # (cache, "hit" or "miss") to count
+        self.cache = {}
+
+        self.lock = threading.Lock()
+        self.server = None
+
+    def observe_request(self, url: str, seconds: float, status: int | str):
+        # count a request and its latency, status is "error" if no response came back
+
+        name = endpoint(url)
+
+        if status != "error":
+
+            status = str(status) if status in TRACKED_STATUSES else "other"
+
+        with self.lock:
+
+            if name not in self.latency:
+
+                self.latency[name] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+
+            histogram = self.latency[name]
+
+            # count it in the first bucket it fits, buckets are summed when rendered
+            histogram[next((number for number, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound),
+                           len(LATENCY_BUCKETS))] += 1
+            histogram[-1] += seconds
+
+            self.responses[(name, status)] = self.responses.get((name, status), 0) + 1
+
+    def count_retry(self, host: str):
+
+        with self.lock:
+
+            self.retries[host] = self.retries.get(host, 0) + 1
+
+    def add_sleep(self, reason: str, seconds: float):
+
+        if seconds <= 0:
+
+            return
+
+        with self.lock:
+
+            self.sleeps[reason] = self.sleeps.get(reason, 0) + seconds
+
+    def sleep(self, reason: str, seconds: float):
+        # sleep and count the time against a reason
+
+        if seconds > 0:
+
+            time.sleep(seconds)
+            self.add_sleep(reason, seconds)
+
+    def count_cache(self, cache: str, hit: bool):
+
+        key = (cache, "hit" if hit else "miss")
+
+        with self.lock:
+
+            self.cache[key] = self.cache.get(key, 0) + 1
+
+    def render(self):
+        # the metrics in the prometheus text format
+
+        lines = []
+
+        with self.lock:
+
+            lines.append("# HELP tf2trade_request_seconds Time taken by requests to price.tf and backpack.tf")
+            lines.append("# TYPE tf2trade_request_seconds histogram")
+
+            for name, histogram in sorted(self.latency.items()):
+
+                total = 0
+
+                for bound, count in zip(LATENCY_BUCKETS, histogram):
+
+                    total += count
+                    lines.append(f'tf2trade_request_seconds_bucket{{endpoint="{name}",le="{bound}"}} {total}')
+
+                total += histogram[len(LATENCY_BUCKETS)]
+
+                lines.append(f'tf2trade_request_seconds_bucket{{endpoint="{name}",le="+Inf"}} {total}')
+                lines.append(f'tf2trade_request_seconds_sum{{endpoint="{name}"}} {histogram[-1]}')
+                lines.append(f'tf2trade_request_seconds_count{{endpoint="{name}"}} {total}')
+
+            lines.append("# HELP tf2trade_responses_total Responses by endpoint and status code")
+            lines.append("# TYPE tf2trade_responses_total counter")
+
+            for (name, status), count in sorted(self.responses.items()):
+
+                lines.append(f'tf2trade_responses_total{{endpoint="{name}",status="{status}"}} {count}')
+
+            lines.append("# HELP tf2trade_retries_total Requests retried by host")
+            lines.append("# TYPE tf2trade_retries_total counter")
+
+            for host, count in sorted(self.retries.items()):
+
+                lines.append(f'tf2trade_retries_total{{host="{host}"}} {count}')
+
+            lines.append("# HELP tf2trade_sleep_seconds_total Time spent waiting on rate limits and backoff")
+            lines.append("# TYPE tf2trade_sleep_seconds_total counter")
+
+            for reason, seconds in sorted(self.sleeps.items()):
+
+                lines.append(f'tf2trade_sleep_seconds_total{{reason="{reason}"}} {seconds}')
+
+            lines.append("# HELP tf2trade_cache_lookups_total Cache lookups by cache and result")
+            lines.append("# TYPE tf2trade_cache_lookups_total counter")
+
+            for (cache, result), count in sorted(self.cache.items()):
+
+                lines.append(f'tf2trade_cache_lookups_total{{cache="{cache}",result="{result}"}} {count}')
+
+            lines.append("# HELP tf2trade_cache_hit_ratio Share of cache lookups that were hits")
+            lines.append("# TYPE tf2trade_cache_hit_ratio gauge")
+
+            for cache in sorted({cache for cache, _ in self.cache}):
+
+                hits = self.cache.get((cache, "hit"), 0)
+                lookups = hits + self.cache.get((cache, "miss"), 0)
+
+                lines.append(f'tf2trade_cache_hit_ratio{{cache="{cache}"}} {hits / lookups}')
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9100, host: str = "127.0.0.1"):
+        # export the metrics at http://host:port/metrics from a background thread
+
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+
+                if self.path.rstrip("/") not in ("", "/metrics"):
+
+                    self.send_error(404)
+                    return
+
+                content = metrics.render().encode()
+
+                self.send_response(200)
+                self.send_header('Content-Type', "text/plain; version=0.0.4")
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        return self.server
+
+    def stop(self):
+
+        if self.server is not None:
+
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,312 @@
+from collections import deque
+import threading
+import logging
+import heapq
+import json
+import time
+
+from listing_stream import BestListings, Listing
+
+
+# backpack.tf's listing event feed
+EVENTS_URL = "wss://ws.backpack.tf/events"
+
+# the attributes of spelled items, filtered out of the book like refine_ks_flips does
+SPELL_ATTRIBUTES = (1004, 1005, 1006, 1007, 1008, 1009)
+
+
+class OrderBook:
+
+    def __init__(self, banned_attributes: tuple = SPELL_ATTRIBUTES, currency=None, stale_after: float = 60,
+                 replay_window: float = 120):
+
+        self.banned_attributes = set(banned_attributes)
+
+        # if given a CurrencyEngine listings are ranked in half scrap like grab_listings does
+        self.currency = currency
+
+        # listing id to (version, item name, intent, listing) for every listing in the book
+        # listings are kept as compact Listing records rather than their json
+        self.listings = {}
+
+        # (item name, intent) to a heap of (key, version, listing id) with the best listing on top
+        # updated and deleted listings are left in the heaps and skipped when they reach the top
+        self.heaps = {}
+
+        # (item name, intent) to how many live listings its heap holds
+        self.live = {}
+
+        # items whose whole book we have from a snapshot so the book can answer for them
+        self.seeded = set()
+
+        # (time received, item name, event) for every event of the last replay_window seconds
+        # a snapshot can be older than the events that arrived while it was cached or in flight
+        # so the ones that came after it are applied again once it is seeded
+        self.replay_window = replay_window
+        self.recent = deque()
+
+        # the book only answers while its feed is running and has sent an event in the last stale_after seconds
+        # otherwise callers go back to snapshots
+        self.stale_after = stale_after
+        self.running = False
+        self.last_event = 0
+
+        self.version = 0
+        self.events = 0
+
+        self.lock = threading.Lock()
+
+    def keep(self, listing: Listing):
+        # check a listing against the same filters as BestListings
+
+        return (listing.intent in ('buy', 'sell') and self.banned_attributes.isdisjoint(listing.attributes)
+                and listing.price is not None and not (listing.usd and self.currency is None))
+
+    def add(self, listing: dict | Listing, item_name: str = None):
+        # put a new or updated listing into the book, json listings are named by their item
+
+        if not isinstance(listing, Listing):
+
+            item_name = item_name if item_name is not None else listing['item']['name']
+            listing = Listing.from_json(listing)
+
+        self.remove(listing.id)
+
+        if self.currency is not None:
+
+            # a listing in keys cannot be ranked without a key rate so it is left out like usd ones
+            try:
+
+                listing.price = self.currency.half_scrap(listing.keys, listing.metal, listing.usd)
+
+            except ValueError:
+
+                listing.price = None
+
+        if not self.keep(listing):
+
+            return
+
+        self.version += 1
+
+        intent = listing.intent
+
+        # sell listings are best when cheapest and buy listings when most profitable
+        key = listing.price if intent == 'sell' else -listing.price
+
+        self.listings[listing.id] = (self.version, item_name, intent, listing)
+        self.live[(item_name, intent)] = self.live.get((item_name, intent), 0) + 1
+
+        heap = self.heaps.setdefault((item_name, intent), [])
+        heapq.heappush(heap, (key, self.version, listing.id))
+
+        # rebuild a heap once it is mostly stale entries
+        if len(heap) > 2 * self.live[(item_name, intent)] + 16:
+
+            heap[:] = [entry for entry in heap if self.listings.get(entry[2], (None,))[0] == entry[1]]
+            heapq.heapify(heap)
+
+    def remove(self, listing_id: str):
+
+        if (entry := self.listings.pop(listing_id, None)) is not None:
+
+            self.live[(entry[1], entry[2])] -= 1
+
+    def seed(self, item_name: str, listings: list, created_at: float = None):
+        # replace an item's book with a snapshot of it taken at created_at
+        # then apply the events of the item that arrived since
+
+        with self.lock:
+
+            for heap in (self.heaps.pop((item_name, 'buy'), []), self.heaps.pop((item_name, 'sell'), [])):
+
+                for _, _, listing_id in heap:
+
+                    if listing_id in self.listings and self.listings[listing_id][1] == item_name:
+
+                        self.remove(listing_id)
+
+            for listing in listings:
+
+                self.add(listing, item_name)
+
+            self.seeded.add(item_name)
+
+            for received_at, event_item, event in self.recent:
+
+                if created_at is not None and received_at < created_at:
+
+                    continue
+
+                # delete events may not name their item so only replay those for listings of this item
+                if event_item == item_name or (event_item is None and event.get('event') == 'listing-delete'
+                                               and self.listings.get(event['payload']['id'], (None, None))[1]
+                                               == item_name):
+
+                    self.update(event)
+
+    def apply(self, event: dict):
+        # apply a listing-update or listing-delete event
+        # a malformed event is logged and skipped so it never stops the feed
+
+        with self.lock:
+
+            self.events += 1
+            self.last_event = time.time()
+
+            try:
+
+                item_name = event['payload'].get('item', {}).get('name')
+
+                self.recent.append((self.last_event, item_name, event))
+
+                self.update(event)
+
+            except (KeyError, TypeError, AttributeError, ValueError) as error:
+
+                logging.info(f"Skipping listing event {event!r}: {error!r}")
+
+            # forget the events too old to be newer than any snapshot we could still be sent
+            while self.recent and self.recent[0][0] < self.last_event - self.replay_window:
+
+                self.recent.popleft()
+
+    def update(self, event: dict):
+        # change the book by one event, the caller holds the lock
+
+        match event.get('event'):
+
+            case 'listing-update' | 'listing-create':
+
+                # the book can only answer for seeded items so listings of any other item are not kept
+                if event['payload']['item']['name'] in self.seeded:
+
+                    self.add(event['payload'])
+
+            case 'listing-delete':
+
+                self.remove(event['payload']['id'])
+
+            case _:
+
+                logging.info(f"Ignoring {event.get('event')} event")
+
+    def consume(self, messages):
+        # apply every event in a feed, each message is json holding one event or a list of them
+        # the book answers for its items only while this runs
+
+        self.running = True
+        self.last_event = time.time()
+
+        try:
+
+            for message in messages:
+
+                try:
+
+                    events = json.loads(message) if isinstance(message, (str, bytes)) else message
+
+                except ValueError as error:
+
+                    logging.info(f"Skipping listing feed message: {error}")
+
+                    continue
+
+                for event in events if isinstance(events, list) else [events]:
+
+                    self.apply(event)
+
+        # if the feed drops ie the websocket disconnects
+        except Exception as error:
+
+            logging.info(f"Listing feed stopped: {error!r}")
+
+        finally:
+
+            self.running = False
+
+    def run_in_background(self, messages):
+        # consume a feed from a daemon thread
+
+        thread = threading.Thread(target=self.consume, args=(messages,), daemon=True)
+        thread.start()
+
+        return thread
+
+    def is_live(self):
+        # check if the feed is still running and has not gone quiet
+
+        return self.running and time.time() - self.last_event < self.stale_after
+
+    def covers(self, item_name: str, banned_attributes: tuple = ()):
+        # check if the book can answer for an item with these filters
+
+        return item_name in self.seeded and set(banned_attributes) == self.banned_attributes and self.is_live()
+
+    def best_k(self, item_name: str, intent: str, k: int = 1):
+        # the k best live listings of an item for an intent best first
+
+        with self.lock:
+
+            heap = self.heaps.get((item_name, intent), [])
+
+            # drop the stale entries sitting on top
+            while heap and self.listings.get(heap[0][2], (None,))[0] != heap[0][1]:
+
+                heapq.heappop(heap)
+
+            if k == 1:
+
+                return [self.listings[heap[0][2]][3]] if heap else []
+
+            return [self.listings[listing_id][3] for _, version, listing_id in heapq.nsmallest(len(heap), heap)
+                    if self.listings.get(listing_id, (None,))[0] == version][:k]
+
+    def best(self, item_name: str, intent: str):
+        # the best live listing of an item for an intent or None
+
+        listings = self.best_k(item_name, intent)
+
+        return listings[0] if listings else None
+
+    def best_listings(self, item_name: str, k: int = 1):
+        # the book of an item as the BestListings grab_listings returns
+
+        return BestListings(self.banned_attributes, k=k, currency=self.currency).extend(
+            self.best_k(item_name, 'sell', k) + self.best_k(item_name, 'buy', k))
+
+
+def websocket_feed(url: str = EVENTS_URL):
+    # yield the messages of the live backpack.tf feed, needs the websocket-client package
+
+    try:
+
+        import websocket
+
+    except ImportError:
+
+        raise ImportError("The live listing feed needs websocket-client, install it with pip install websocket-client")
+
+    connection = websocket.create_connection(url)
+
+    try:
+
+        while True:
+
+            yield connection.recv()
+
+    finally:
+
+        connection.close()
+
+
+def file_feed(path: str):
+    # yield the messages of a recorded feed, one json message per line
+
+    with open(path, encoding='utf-8') as file:
+
+        for line in file:
+
+            if line.strip():
+
+                yield line
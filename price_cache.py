@@ -0,0 +1,108 @@
+import sqlite3
+import threading
+import json
+import time
+from datetime import date
+
+
+class PriceCache:
+
+    def __init__(self, path: str = "price_cache.sqlite", max_entries: int = 5000, max_age: float = None):
+
+        # the most prices we keep before evicting the least recently used
+        self.max_entries = max_entries
+
+        # if set, the most seconds a price is served after it was fetched
+        self.max_age = max_age
+
+        # the cache is shared between price check workers so guard the connection
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        self.connection.execute("CREATE TABLE IF NOT EXISTS prices ("
+                                "sku TEXT PRIMARY KEY, "
+                                "price TEXT NOT NULL, "
+                                "updated_at TEXT NOT NULL, "
+                                "fetched_at REAL NOT NULL, "
+                                "last_used REAL NOT NULL)")
+        self.connection.commit()
+
+        # count the lookups so the hit ratio can be reported
+        self.hits = 0
+        self.misses = 0
+
+        # sku to when it was last used, written in batches so a cache hit never waits on a disk sync
+        # only the eviction order depends on it so losing a batch in a crash does no harm
+        self.used = {}
+        self.flush_every = 256
+
+    def get(self, item_sku: str, oldest: date):
+        # return the cached price for a sku if it was updated on or after the oldest date
+
+        with self.lock:
+
+            row = self.connection.execute("SELECT price, updated_at, fetched_at FROM prices WHERE sku = ?",
+                                          (item_sku,)).fetchone()
+
+            # if we do not have the sku or the price has gone stale
+            if (row is None or date.fromisoformat(row[1][:10]) < oldest
+                    or (self.max_age is not None and time.time() - row[2] > self.max_age)):
+
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+            # mark it as used so it is not the next to be evicted
+            self.used[item_sku] = time.time()
+
+            if len(self.used) >= self.flush_every:
+
+                self.flush()
+                self.connection.commit()
+
+            return json.loads(row[0])
+
+    def flush(self):
+        # write the buffered last used times, the caller holds the lock and commits
+
+        self.connection.executemany("UPDATE prices SET last_used = ? WHERE sku = ?",
+                                    [(last_used, item_sku) for item_sku, last_used in self.used.items()])
+        self.used.clear()
+
+    def put(self, item_sku: str, price: dict):
+        # save a price.tf price and evict the oldest prices if the cache is full
+
+        now = time.time()
+
+        with self.lock:
+
+            # evict by up to date last used times
+            self.flush()
+
+            self.connection.execute("INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?)",
+                                    (item_sku, json.dumps(price), price["updatedAt"], now, now))
+
+            self.connection.execute("DELETE FROM prices WHERE sku IN "
+                                    "(SELECT sku FROM prices ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                                    (self.max_entries,))
+            self.connection.commit()
+
+    def clear(self):
+        # drop every cached price
+
+        with self.lock:
+
+            self.used.clear()
+
+            self.connection.execute("DELETE FROM prices")
+            self.connection.commit()
+
+    def close(self):
+
+        with self.lock:
+
+            self.flush()
+            self.connection.commit()
+
+            self.connection.close()
@@ -0,0 +1,210 @@
+import threading
+import logging
+import base64
+import json
+import time
+
+import requests
+
+from retry import RetryPolicy
+from checkpoint import save_json
+
+
+class TokenRequestFailed(requests.RequestException):
+    # price.tf would not hand out a token, already counted towards its circuit breaker
+    pass
+
+
+class TokenManager:
+
+    def __init__(self, transport, path: str = "price_token.json", refresh_margin: float = 60,
+                 default_lifetime: float = 600, url: str = "https://api2.prices.tf/auth/access",
+                 retry_policy: RetryPolicy = None, host: str = None, wait=None, back_off=None, persist: bool = True):
+
+        self.transport = transport
+        self.url = url
+
+        # token requests are retried like every other price.tf request and count towards its circuit breaker
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.host = host if host is not None else url
+
+        # wait blocks while price.tf has asked us to back off and back_off(seconds) is told of a 429
+        # so a throttled token request holds back the other price.tf requests too
+        self.wait = wait
+        self.back_off = back_off
+
+        # where the token is kept between runs
+        # not written when persist is off ie when replaying a cassette hands out a fake token
+        self.path = path
+        self.persist = persist
+
+        # refresh this many seconds before the token lapses
+        self.refresh_margin = refresh_margin
+
+        # how long a token we cannot read the expiry of is trusted for
+        self.default_lifetime = default_lifetime
+
+        self.token = None
+        self.expires_at = 0
+
+        # the token is shared by every worker so only one of them refreshes it at a time
+        self.lock = threading.Lock()
+        self.timer = None
+
+        self.load()
+
+    def expiry(self, token: str):
+        # read the expiry out of the token's jwt payload
+
+        try:
+
+            payload = token.split(".")[1]
+            payload += "=" * (-len(payload) % 4)
+
+            return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+
+        except (IndexError, ValueError, KeyError, TypeError):
+
+            return time.time() + self.default_lifetime
+
+    def is_fresh(self):
+
+        return self.token is not None and time.time() < self.expires_at - self.refresh_margin
+
+    def load(self):
+        # pick up the token saved by the last run if it is still good
+
+        try:
+
+            with open(self.path, encoding='utf-8') as file:
+                saved = json.load(file)
+
+        except (FileNotFoundError, json.JSONDecodeError):
+
+            return
+
+        self.token = saved['accessToken']
+        self.expires_at = self.expiry(self.token)
+
+        if self.is_fresh():
+
+            logging.info("Using the saved price.tf token")
+            self.schedule()
+
+        else:
+
+            self.token = None
+
+    def save(self):
+
+        if not self.persist:
+
+            return
+
+        # replaced in one step since worker processes in one directory share it
+        save_json(self.path, {'accessToken': self.token})
+
+    def refresh(self, retries: int = None):
+        # request a new token, save it and schedule the next refresh
+        # raises TokenRequestFailed if price.tf would not hand one out so callers treat it like a failed request
+
+        for _ in (retry := self.retry_policy.begin(self.host, retries)):
+
+            if self.wait is not None:
+
+                self.wait()
+
+            try:
+
+                page = self.transport.post(self.url)
+
+            except requests.RequestException as error:
+
+                logging.info(f"Price.tf token request failed: {error}")
+                retry.failed()
+
+                continue
+
+            if page.ok:
+
+                retry.succeeded()
+
+                self.token = page.json()["accessToken"]
+                self.expires_at = self.expiry(self.token)
+
+                self.save()
+                self.schedule()
+
+                return
+
+            match page.status_code:
+
+                # if Error: Too Many Requests
+                case 429:
+
+                    if self.back_off is not None:
+
+                        self.back_off(int(page.headers['retry-after'])/1000)
+
+                    retry.failed(retry_after=int(page.headers['retry-after'])/1000, trip=False)
+
+                # if the request fails for some other reason
+                case _:
+
+                    logging.info(f"Error {page.status_code}: Price.tf token request failed")
+                    retry.failed(trip=page.status_code >= 500)
+
+        raise TokenRequestFailed("Could not get a price.tf token")
+
+    def schedule(self):
+        # refresh the token in the background shortly before it lapses
+
+        if self.timer is not None:
+
+            self.timer.cancel()
+
+        self.timer = threading.Timer(max(self.expires_at - self.refresh_margin - time.time(), 1),
+                                     self.background_refresh)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def background_refresh(self):
+
+        with self.lock:
+
+            try:
+
+                self.refresh()
+
+            # if it fails the next get will try again
+            except Exception as error:
+
+                logging.info(f"Background price.tf token refresh failed: {error}")
+
+    def get(self):
+        # the current token, refreshed first if it is missing or about to lapse
+        # with a single attempt since the caller's own retries cover the request that needs it
+
+        with self.lock:
+
+            if not self.is_fresh():
+
+                self.refresh(retries=0)
+
+            return self.token
+
+    def invalidate(self, token: str):
+        # a request with this token was refused
+        # if no other worker has replaced it yet drop it so the next get requests a new one
+
+        with self.lock:
+
+            if token == self.token:
+
+                self.token = None
+
+    def close(self):
+
+        if self.timer is not None:
+
+            self.timer.cancel()
@@ -0,0 +1,226 @@
+from collections import deque
+import threading
+import atexit
+import itertools
+import logging
+import heapq
+import json
+import time
+
+from checkpoint import save_json
+
+
+class RefreshQueue:
+    # sends price.tf refresh requests from a background thread instead of inline with price checks
+    # a sku is queued once however often it is seen and is not refreshed again within the cooldown
+
+    def __init__(self, send, budget: int = 6, window: float = 60, cooldown: float = 24 * 60 * 60,
+                 path: str = "refresh_log.json"):
+
+        # asks price.tf to reprice a sku and returns True if it was accepted
+        self.send = send
+
+        # the share of the price.tf rate limit refreshes may use, budget requests in every window of seconds
+        self.budget = budget
+        self.window = window
+
+        # how many seconds a refreshed sku is left alone for, kept across runs in path
+        # along with the skus still queued when the run ended
+        self.cooldown = cooldown
+        self.path = path
+
+        # sku to when it was last refreshed
+        self.refreshed = {}
+
+        saved = {}
+
+        try:
+
+            with open(path, encoding='utf-8') as file:
+                saved = json.load(file)
+
+        except (FileNotFoundError, json.JSONDecodeError):
+
+            pass
+
+        # older logs only hold the refresh times
+        if 'refreshed' in saved:
+
+            self.refreshed = saved['refreshed']
+
+        else:
+
+            self.refreshed = saved
+
+        # max heap of queued skus by priority like SnapshotScheduler
+        self.queue = []
+        self.priorities = {}
+        self.order = itertools.count()
+
+        # the times of the refreshes sent within the current window
+        self.sent = deque()
+
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+        # while held skus are queued but not sent so a sweep can set their priorities first
+        self.holds = 0
+
+        for item_sku, priority in saved.get('pending', {}).items():
+
+            self.push(item_sku, priority)
+
+        # keep what is still queued for the next run instead of dropping it with the daemon thread
+        atexit.register(self.save)
+
+    def start(self):
+        # start sending in the background, the caller holds the condition
+
+        if self.thread is None:
+
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def hold(self):
+        # stop sending until release is called as many times
+
+        with self.condition:
+
+            self.holds += 1
+
+    def release(self):
+
+        with self.condition:
+
+            self.holds -= 1
+            self.condition.notify()
+
+    def is_recent(self, item_sku: str):
+
+        return time.time() - self.refreshed.get(item_sku, 0) < self.cooldown
+
+    def push(self, item_sku: str, priority: float = 0):
+        # queue a sku to be refreshed, a sku queued twice keeps its highest priority
+
+        with self.condition:
+
+            if self.is_recent(item_sku) or self.priorities.get(item_sku, float('-inf')) >= priority:
+
+                return
+
+            self.priorities[item_sku] = priority
+            heapq.heappush(self.queue, (-priority, next(self.order), item_sku))
+
+            self.start()
+            self.condition.notify()
+
+    def bump(self, item_sku: str, priority: float):
+        # raise the priority of a sku that is already queued
+
+        if item_sku in self.priorities:
+
+            self.push(item_sku, priority)
+
+    def pop(self):
+        # take the highest priority sku off the queue, skipping entries that were re queued higher
+
+        while self.queue:
+
+            priority, _, item_sku = heapq.heappop(self.queue)
+
+            if self.priorities.get(item_sku) == -priority:
+
+                del self.priorities[item_sku]
+                return item_sku
+
+        return None
+
+    def time_till_free(self):
+        # seconds until another refresh fits into the budget
+
+        now = time.time()
+
+        while self.sent and self.sent[0] <= now - self.window:
+
+            self.sent.popleft()
+
+        if len(self.sent) < self.budget:
+
+            return 0
+
+        return self.sent[0] + self.window - now
+
+    def run(self):
+        # send the queued refreshes highest priority first within the budget
+
+        while True:
+
+            with self.condition:
+
+                while not self.stopped and (not self.priorities or self.holds or self.time_till_free() > 0):
+
+                    self.condition.wait(self.time_till_free() or None)
+
+                if self.stopped:
+
+                    return
+
+                item_sku = self.pop()
+                self.sent.append(time.time())
+
+                if item_sku is None:
+
+                    continue
+
+                # count it as refreshed while it is in flight so it is not queued again
+                self.refreshed[item_sku] = time.time()
+
+            try:
+
+                accepted = self.send(item_sku)
+
+            except Exception as error:
+
+                logging.info(f"Refresh of {item_sku} failed: {error}")
+                accepted = False
+
+            with self.condition:
+
+                if not accepted:
+
+                    del self.refreshed[item_sku]
+
+                    continue
+
+                logging.info(f"Requested price update on {item_sku}")
+
+                self.save()
+
+    def save(self):
+        # write the refresh times and the queued skus to path
+
+        with self.condition:
+
+            # forget skus whose cooldown is over so the log stays small
+            self.refreshed = {refreshed_sku: refreshed_at for refreshed_sku, refreshed_at
+                              in self.refreshed.items() if time.time() - refreshed_at < self.cooldown}
+
+            try:
+
+                save_json(self.path, {'refreshed': self.refreshed, 'pending': self.priorities})
+
+            except OSError as error:
+
+                logging.info(f"Could not save the refresh log: {error}")
+
+    def pending(self):
+
+        return len(self.priorities)
+
+    def close(self):
+
+        with self.condition:
+
+            self.stopped = True
+            self.condition.notify()
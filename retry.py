@@ -0,0 +1,158 @@
+import threading
+import logging
+import random
+import time
+
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60):
+
+        # how many failures in a row open the circuit
+        self.failure_threshold = failure_threshold
+
+        # how long an open circuit blocks requests before letting a trial request thru
+        self.reset_timeout = reset_timeout
+
+        self.failures = 0
+        self.opened_at = None
+
+        self.lock = threading.Lock()
+
+    def allow(self):
+        # check if a request may be sent
+
+        with self.lock:
+
+            # if the circuit is closed
+            if self.opened_at is None:
+
+                return True
+
+            # if the circuit has been open long enough let one trial request thru
+            # and hold the rest until it reports back
+            if time.time() - self.opened_at >= self.reset_timeout:
+
+                self.opened_at = time.time()
+                return True
+
+            return False
+
+    def record_success(self):
+
+        with self.lock:
+
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+
+        with self.lock:
+
+            self.failures += 1
+
+            if self.failures >= self.failure_threshold:
+
+                self.opened_at = time.time()
+
+
+class RetryPolicy:
+
+    def __init__(self, retries: int = 3, base_delay: float = 0.5, max_delay: float = 30,
+                 failure_threshold: int = 5, reset_timeout: float = 60):
+
+        # the default number of retries after the first attempt
+        self.retries = retries
+
+        # the backoff doubles from base_delay each retry up to max_delay
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        # if set retries and the time spent backing off are counted
+        self.metrics = None
+
+        # one circuit breaker per host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+
+        self.lock = threading.Lock()
+
+    def breaker(self, host: str):
+
+        with self.lock:
+
+            if host not in self.breakers:
+
+                self.breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+
+            return self.breakers[host]
+
+    def backoff(self, attempt: int, retry_after: float = None):
+        # how long to wait before a retry
+        # capped exponential backoff with full jitter, or the retry-after we were given plus a little jitter
+
+        if retry_after is not None:
+
+            return retry_after + random.uniform(0, self.base_delay)
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def begin(self, host: str, retries: int = None):
+        # start the attempts of one request
+
+        return Retry(self, host, self.retries if retries is None else retries)
+
+
+class Retry:
+
+    def __init__(self, policy: RetryPolicy, host: str, retries: int):
+
+        self.policy = policy
+        self.host = host
+        self.retries = retries
+
+        self.breaker = policy.breaker(host)
+
+        # the retry-after of the last failed attempt if it had one
+        self.retry_after = None
+
+    def __iter__(self):
+        # yield each attempt waiting out the backoff between them
+        # stops early if the host's circuit is open
+
+        for attempt in range(self.retries + 1):
+
+            if attempt:
+
+                backoff = self.policy.backoff(attempt - 1, self.retry_after)
+                self.retry_after = None
+
+                if self.policy.metrics is not None:
+
+                    self.policy.metrics.count_retry(self.host)
+                    self.policy.metrics.add_sleep("retry backoff", backoff)
+
+                time.sleep(backoff)
+
+            if not self.breaker.allow():
+
+                logging.info(f"Circuit open for {self.host}: not sending the request")
+                return
+
+            yield attempt
+
+    def succeeded(self):
+        # the host answered properly
+
+        self.breaker.record_success()
+
+    def failed(self, retry_after: float = None, trip: bool = True):
+        # the attempt failed and should be retried
+        # failures that do not mean the host is down ie a 429 should not trip the breaker
+
+        self.retry_after = retry_after
+
+        if trip:
+
+            self.breaker.record_failure()
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import logging
+
+
+# bump when the way the table is generated changes so old tables are rebuilt
+SKU_TABLE_VERSION = 1
+
+# every quality and killstreak tier the table is generated for
+QUALITIES = ("", "Strange")
+KILLSTREAK_TIERS = ("Killstreak", "Specialized Killstreak", "Professional Killstreak")
+
+
+def weapon_name(weapon: str, quality: str = "", tier: str = "Killstreak"):
+    # build the item name of a killstreak weapon ie "Strange Killstreak Fists"
+
+    return " ".join(part for part in (quality, tier, weapon) if part)
+
+
+def kit_name(weapon: str, quality: str = "", tier: str = "Killstreak"):
+    # build the item name of a killstreak kit ie "Non-Craftable Killstreak Fists Kit"
+
+    return " ".join(part for part in ("Non-Craftable", quality, tier, weapon, "Kit") if part)
+
+
+def name_to_sku(name: str):
+    # parse an item name into its sku
+    # sku.parser is only imported when a name is missing from the table as it is slow to load
+
+    import sku.parser
+
+    return sku.parser.Sku.name_to_sku(name)
+
+
+def load_weapon_names(path: str = "killstreakable_weapons_names.txt"):
+    # read the killstreakable weapons removing blank lines and duplicates
+
+    with open(path, encoding='utf-8') as file:
+        weapon_names = file.read().split("\n")
+
+    return list(dict.fromkeys([weapon for weapon in weapon_names if weapon != ""]))
+
+
+class SkuTable:
+
+    def __init__(self, path: str = "sku_table.json", names_path: str = "killstreakable_weapons_names.txt"):
+
+        self.path = path
+        self.names_path = names_path
+
+        # hash the weapon list so the table is rebuilt when it is edited
+        with open(names_path, "rb") as file:
+            self.source_hash = hashlib.sha1(file.read()).hexdigest()
+
+        self.weapons = []
+        self.rows = []
+
+        # map every item name in the table to its sku
+        self.names = {}
+
+        self.load()
+
+    def load(self):
+        # load the table from disk and rebuild it if it is missing or out of date
+
+        try:
+
+            with open(self.path, encoding='utf-8') as file:
+                table = json.load(file)
+
+        except (FileNotFoundError, json.JSONDecodeError):
+
+            table = None
+
+        if table is None or table['version'] != SKU_TABLE_VERSION or table['source'] != self.source_hash:
+
+            logging.info(f"Rebuilding the sku table at {self.path}")
+            table = self.build()
+
+        self.weapons = table['weapons']
+        self.rows = table['rows']
+
+        for row in self.rows:
+
+            self.names[weapon_name(row['weapon'], row['quality'], row['tier'])] = row['weapon_sku']
+            self.names[kit_name(row['weapon'], row['quality'], row['tier'])] = row['kit_sku']
+
+    def build(self):
+        # parse every weapon and kit name for every quality and tier and save the table
+
+        weapons = load_weapon_names(self.names_path)
+
+        rows = [{'weapon': weapon, 'quality': quality, 'tier': tier,
+                 'weapon_sku': name_to_sku(weapon_name(weapon, quality, tier)),
+                 'kit_sku': name_to_sku(kit_name(weapon, quality, tier))}
+                for weapon in weapons for quality in QUALITIES for tier in KILLSTREAK_TIERS]
+
+        table = {'version': SKU_TABLE_VERSION, 'source': self.source_hash, 'weapons': weapons, 'rows': rows}
+
+        with open(self.path, "w", encoding='utf-8') as file:
+            json.dump(table, file, indent=1)
+
+        return table
+
+    def lookup(self, name: str):
+        # get the sku of an item name
+        # names outside the table are parsed once and remembered
+
+        if (item_sku := self.names.get(name)) is None:
+
+            item_sku = self.names[name] = name_to_sku(name)
+
+        return item_sku
+
+    def weapon_sku(self, weapon: str, quality: str = "", tier: str = "Killstreak"):
+
+        return self.lookup(weapon_name(weapon, quality, tier))
+
+    def kit_sku(self, weapon: str, quality: str = "", tier: str = "Killstreak"):
+
+        return self.lookup(kit_name(weapon, quality, tier))
@@ -0,0 +1,156 @@
+from collections import deque
+import itertools
+import heapq
+import time
+
+
+class SnapshotScheduler:
+
+    def __init__(self, budget: int = 10, window: float = 60, cache_ttl: float = 60):
+
+        # backpack.tf allows each api token a budget of snapshot requests in every window of seconds
+        self.budget = budget
+        self.window = window
+
+        # backpack.tf caches each sku's snapshot so requesting it again sooner returns the same listings
+        self.cache_ttl = cache_ttl
+
+        # token to the times of the requests it sent within the current window
+        # and when backpack.tf will accept requests with it again after a 429
+        self.sent = {}
+        self.retry_at = {}
+
+        # if set the time spent waiting is counted
+        self.metrics = None
+
+        # sku to (time fetched, listings)
+        self.cache = {}
+
+        # max heap of queued skus by priority, ties keep the order they were queued in
+        self.queue = []
+        self.priorities = {}
+        self.order = itertools.count()
+
+    def add_token(self, token: str):
+        # put a backpack.tf token into rotation, every token has its own budget
+
+        if token not in self.sent:
+
+            self.sent[token] = deque()
+            self.retry_at[token] = 0
+
+    def time_till_free(self, token: str, now: float):
+        # seconds until a token can send another request
+
+        sent = self.sent[token]
+
+        # forget requests that have left the window
+        while sent and sent[0] <= now - self.window:
+
+            sent.popleft()
+
+        time_till_free = self.retry_at[token] - now
+
+        if len(sent) >= self.budget:
+
+            time_till_free = max(time_till_free, sent[0] + self.window - now)
+
+        return time_till_free
+
+    def wait_for_budget(self):
+        # block until a token can fit another snapshot request into its budget
+        # then count the request against it and return it
+
+        if not self.sent:
+
+            self.add_token(None)
+
+        while True:
+
+            now = time.time()
+
+            # use whichever token frees up first
+            time_till_free, token = min(((self.time_till_free(token, now), token) for token in self.sent),
+                                        key=lambda pair: pair[0])
+
+            if time_till_free <= 0:
+
+                self.sent[token].append(now)
+                return token
+
+            print(f"Too many requests: Cannot request for {int(time_till_free)} seconds")
+            time.sleep(time_till_free)
+
+            if self.metrics is not None:
+
+                self.metrics.add_sleep("backpack retry-after" if self.retry_at[token] > now else "backpack budget",
+                                       time_till_free)
+
+    def back_off(self, seconds: float, token: str = None):
+        # take a token out of rotation for a number of seconds ie after a 429
+        # without a token every token is held back
+
+        for held_token in ([token] if token in self.retry_at else list(self.retry_at)):
+
+            self.retry_at[held_token] = max(self.retry_at[held_token], time.time() + seconds)
+
+    def is_cached(self, item_name: str):
+
+        return item_name in self.cache and time.time() - self.cache[item_name][0] < self.cache_ttl
+
+    def cached(self, item_name: str):
+
+        return self.cache[item_name][1]
+
+    def save(self, item_name: str, listings: list):
+
+        self.cache[item_name] = (time.time(), listings)
+
+    def push(self, item_name: str, priority: float):
+        # queue a sku to be fetched, a sku queued twice keeps its highest priority
+
+        if item_name in self.priorities and self.priorities[item_name] >= priority:
+
+            return
+
+        self.priorities[item_name] = priority
+        heapq.heappush(self.queue, (-priority, next(self.order), item_name))
+
+    def pop(self):
+        # take the highest priority sku off the queue
+
+        while self.queue:
+
+            priority, _, item_name = heapq.heappop(self.queue)
+
+            # skip entries that were re queued with a higher priority
+            if self.priorities.get(item_name) == -priority:
+
+                del self.priorities[item_name]
+                return item_name
+
+        return None
+
+    def dispatch(self, fetch, skip=None):
+        # fetch every queued sku highest priority first, yielding each as soon as it is fetched
+        # skus skip returns true for are dropped without spending a request
+
+        try:
+
+            while (item_name := self.pop()) is not None:
+
+                if skip is not None and skip(item_name):
+
+                    continue
+
+                yield item_name, fetch(item_name)
+
+        # if the pass is cut off by an error drop what is left so the next pass does not fetch it for nothing
+        finally:
+
+            self.clear()
+
+    def clear(self):
+
+        self.queue.clear()
+        self.priorities.clear()
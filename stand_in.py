@@ -0,0 +1,321 @@
+import http.server
+import threading
+import hashlib
+import math
+import random
+import base64
+import json
+import time
+from datetime import date
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from metrics import endpoint
+
+
+class StandInServer:
+    # a local server answering the price.tf and backpack.tf endpoints PriceGrabber uses
+    # /auth/access, /prices, /prices/{sku}, /prices/{sku}/refresh and /classifieds/listings/snapshot
+
+    def __init__(self, latency: float = 0.0, rate_429: float = 0.0, retry_after: float = 1, snapshot_size: int = 100,
+                 price_list_size: int = 5000, token_lifetime: float = 3600, token_budget: int = 0,
+                 token_window: float = 60, port: int = 0, seed: int = 0):
+
+        # seconds added to every response
+        self.latency = latency
+
+        # the share of requests answered with a 429 and the retry-after sent with it in seconds
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+
+        # how many listings each snapshot holds
+        self.snapshot_size = snapshot_size
+
+        # how many filler prices the bulk price list holds on top of any added skus
+        self.price_list_size = price_list_size
+
+        # how long issued tokens last before requests with them get a 401
+        self.token_lifetime = token_lifetime
+
+        # if set each backpack.tf token may request token_budget snapshots in every token_window seconds
+        self.token_budget = token_budget
+        self.token_window = token_window
+
+        # token to the times of its snapshot requests
+        self.token_requests = {}
+
+        # skus that are in the bulk price list
+        self.skus = set()
+
+        self.random = random.Random(seed)
+
+        # request counts by endpoint
+        self.counts = {}
+        self.lock = threading.Lock()
+
+        stand_in = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            # keep connections alive so pooled clients can reuse them
+            protocol_version = "HTTP/1.1"
+
+            # send the headers and body without waiting on delayed acks
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+
+                stand_in.answer(self, "GET")
+
+            def do_POST(self):
+
+                stand_in.answer(self, "POST")
+
+            def log_message(self, *args):
+
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    @property
+    def total_requests(self):
+
+        return sum(self.counts.values())
+
+    def start(self):
+
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+
+        return self.start()
+
+    def __exit__(self, *args):
+
+        self.stop()
+
+    def issue_token(self):
+        # a jwt shaped token carrying its expiry like the real one
+
+        payload = base64.urlsafe_b64encode(json.dumps({'exp': time.time() + self.token_lifetime}).encode())
+
+        return f"stand-in.{payload.decode().rstrip('=')}.stand-in"
+
+    def token_expired(self, authorization: str):
+
+        try:
+
+            payload = authorization.split(" ")[1].split(".")[1]
+
+            return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))['exp'] < time.time()
+
+        except (IndexError, ValueError, KeyError, AttributeError):
+
+            return True
+
+    @staticmethod
+    def price(item_sku: str):
+        # a made up but stable price for a sku
+
+        digest = hashlib.sha1(item_sku.encode()).digest()
+
+        buy = 10 + digest[0] % 200
+        sell = buy + 2 + digest[1] % 40
+
+        return {'sku': item_sku, 'source': "stand-in", 'time': 0,
+                'buyHalfScrap': buy, 'buyKeys': 0, 'buyKeyHalfScrap': None,
+                'sellHalfScrap': sell, 'sellKeys': 0, 'sellKeyHalfScrap': None,
+                'createdAt': date.today().isoformat() + "T00:00:00.000Z",
+                'updatedAt': date.today().isoformat() + "T00:00:00.000Z"}
+
+    def snapshot(self, item_name: str):
+        # a made up but stable snapshot of listings for an item
+
+        rng = random.Random(item_name)
+
+        listings = [self.listing(rng, item_name) for _ in range(self.snapshot_size)]
+
+        return {'listings': listings, 'appid': 440, 'sku': item_name, 'createdAt': int(time.time())}
+
+    @staticmethod
+    def listing(rng: random.Random, item_name: str):
+        # a made up listing for an item
+
+        currencies = {'usd': round(rng.uniform(1, 20), 2)} if rng.random() < 0.05 else {
+            'metal': round(rng.uniform(0.11, 30), 2)}
+
+        return {
+            'id': f"440_{rng.getrandbits(48)}",
+            'steamid': str(76561190000000000 + rng.getrandbits(24)),
+            'appid': 440,
+            'intent': rng.choice(('buy', 'sell')),
+            'price': rng.uniform(1, 300),
+            'currencies': currencies,
+            'bump': 0,
+            'timestamp': int(time.time()),
+            'details': "stand-in listing " * rng.randint(0, 4),
+            'item': {'name': item_name, 'quality': 6,
+                     'attributes': [{'defindex': rng.choice((142, 214, 380, 1004, 2025, 2013))}
+                                    for _ in range(rng.randint(0, 3))]}}
+
+    def events(self, item_names: list, count: int = 1000, seed: int = 0):
+        # a made up listing event feed over the snapshots of some items
+        # yields json messages like backpack.tf's websocket each holding one listing-update or listing-delete
+
+        rng = random.Random(seed)
+
+        live = {item_name: [listing['id'] for listing in self.snapshot(item_name)['listings']]
+                for item_name in item_names}
+
+        for number in range(count):
+
+            item_name = rng.choice(item_names)
+
+            if live[item_name] and rng.random() < 0.3:
+
+                listing_id = live[item_name].pop(rng.randrange(len(live[item_name])))
+
+                event = {'id': str(number), 'event': "listing-delete", 'payload': {'id': listing_id}}
+
+            else:
+
+                listing = self.listing(rng, item_name)
+
+                # update an existing listing half of the time
+                if live[item_name] and rng.random() < 0.5:
+
+                    listing['id'] = rng.choice(live[item_name])
+
+                else:
+
+                    live[item_name].append(listing['id'])
+
+                event = {'id': str(number), 'event': "listing-update", 'payload': listing}
+
+            yield json.dumps([event])
+
+    def price_list(self, page_number: int, limit: int):
+        # one page of the bulk price list
+
+        skus = sorted(self.skus | {f"{number};6" for number in range(self.price_list_size)})
+
+        items = [self.price(item_sku) for item_sku in skus[(page_number - 1) * limit:page_number * limit]]
+
+        return {'items': items, 'meta': {'totalItems': len(skus), 'itemCount': len(items), 'itemsPerPage': limit,
+                                         'totalPages': max(-(-len(skus) // limit), 1), 'currentPage': page_number}}
+
+    def route(self, method: str, path: str, query: dict, form: dict, authorization: str):
+        # work out the status, headers and body for a request
+
+        if method == "POST" and path == "/auth/access":
+
+            return 200, {}, {'accessToken': self.issue_token()}
+
+        if path.startswith("/prices"):
+
+            if self.token_expired(authorization):
+
+                return 401, {}, {'message': "Unauthorized"}
+
+            with self.lock:
+
+                throttled = self.random.random() < self.rate_429
+
+            # price.tf sends its retry-after in milliseconds
+            if throttled:
+
+                return 429, {'retry-after': str(int(self.retry_after * 1000))}, {'message': "Too Many Requests"}
+
+            parts = path.split("/")
+
+            if method == "GET" and len(parts) == 2:
+
+                return 200, {}, self.price_list(int(query.get('page', ['1'])[0]), int(query.get('limit', ['100'])[0]))
+
+            if method == "GET" and len(parts) == 3:
+
+                return 200, {}, self.price(unquote(parts[2]))
+
+            if method == "POST" and len(parts) == 4 and parts[3] == "refresh":
+
+                return 201, {}, {'enqueued': True}
+
+        if method == "GET" and path.endswith("/classifieds/listings/snapshot"):
+
+            with self.lock:
+
+                throttled = self.random.random() < self.rate_429
+
+            # backpack.tf sends its retry-after in seconds
+            if throttled:
+
+                return 429, {'retry-after': str(int(max(self.retry_after, 1)))}, {'message': "Too Many Requests"}
+
+            if self.token_budget:
+
+                with self.lock:
+
+                    now = time.time()
+
+                    requests = [sent for sent in self.token_requests.get(form.get('token', [""])[0], [])
+                                if sent > now - self.token_window]
+
+                    if len(requests) >= self.token_budget:
+
+                        retry_after = requests[0] + self.token_window - now
+
+                        return 429, {'retry-after': str(math.ceil(retry_after))}, {'message': "Too Many Requests"}
+
+                    self.token_requests[form.get('token', [""])[0]] = requests + [now]
+
+            item_name = form.get('sku', query.get('sku', [""]))[0]
+
+            return 200, {}, self.snapshot(item_name)
+
+        return 404, {}, {'message': "Not Found"}
+
+    def answer(self, handler: http.server.BaseHTTPRequestHandler, method: str):
+
+        url = urlsplit(handler.path)
+
+        # requests sends the snapshot parameters as a form body even on a GET
+        body = handler.rfile.read(int(handler.headers.get('Content-Length') or 0)).decode()
+
+        with self.lock:
+
+            name = endpoint(url.path)
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+        if self.latency:
+
+            time.sleep(self.latency)
+
+        status, headers, payload = self.route(method, url.path.rstrip("/"), parse_qs(url.query), parse_qs(body),
+                                              handler.headers.get('Authorization', ""))
+
+        content = json.dumps(payload).encode()
+
+        handler.send_response(status)
+        handler.send_header('Content-Type', "application/json")
+        handler.send_header('Content-Length', str(len(content)))
+
+        for header, value in headers.items():
+
+            handler.send_header(header, value)
+
+        handler.end_headers()
+        handler.wfile.write(content)
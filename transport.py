@@ -0,0 +1,127 @@
+import requests
+import requests.adapters
+from urllib.parse import urlsplit
+import threading
+import time
+
+from cassette import Cassette
+from metrics import Metrics
+
+
+class Transport:
+
+    def __init__(self, pool_connections: int = 4, pool_maxsize: int = 16, pool_sizes: dict = None,
+                 timeout: float | tuple = (5, 30), cassette: Cassette = None, metrics: Metrics = None):
+
+        # how many hosts and connections per host each pool keeps alive
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+
+        # per host overrides of the pool size ie {"api2.prices.tf": 32}
+        self.pool_sizes = pool_sizes or {}
+
+        # the (connect, read) timeout used when a request does not set its own
+        self.timeout = timeout
+
+        # if set every request is recorded to or replayed from the cassette
+        self.cassette = cassette
+
+        # if set every request's latency and status is counted
+        self.metrics = metrics
+
+        # one keep alive session and its stats per host
+        self.sessions = {}
+        self.stats = {}
+
+        self.lock = threading.Lock()
+
+    def session(self, host: str):
+        # get the session for a host opening it the first time the host is used
+
+        with self.lock:
+
+            if host not in self.sessions:
+
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_connections,
+                                                        pool_maxsize=self.pool_sizes.get(host, self.pool_maxsize))
+
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+
+                self.sessions[host] = session
+                self.stats[host] = {'requests': 0, 'errors': 0, 'seconds': 0.0, 'statuses': {}}
+
+            return self.sessions[host]
+
+    def request(self, method: str, url: str, **kwargs):
+        # send a request over the pooled session of its host and record how it went
+
+        host = urlsplit(url).netloc
+        session = self.session(host)
+
+        kwargs.setdefault('timeout', self.timeout)
+
+        start = time.perf_counter()
+
+        try:
+
+            # answer from the cassette without touching the network
+            if self.cassette is not None and self.cassette.mode == "replay":
+
+                page = self.cassette.replay(method, url, kwargs.get('params'), kwargs.get('data'))
+
+            else:
+
+                page = session.request(method, url, **kwargs)
+
+                if self.cassette is not None:
+
+                    self.cassette.record(method, url, kwargs.get('params'), kwargs.get('data'), page)
+
+        # if the connection failed count it and let the caller deal with it
+        except requests.RequestException:
+
+            with self.lock:
+
+                self.stats[host]['requests'] += 1
+                self.stats[host]['errors'] += 1
+                self.stats[host]['seconds'] += time.perf_counter() - start
+
+            if self.metrics is not None:
+
+                self.metrics.observe_request(url, time.perf_counter() - start, "error")
+
+            raise
+
+        with self.lock:
+
+            stats = self.stats[host]
+            stats['requests'] += 1
+            stats['seconds'] += time.perf_counter() - start
+            stats['statuses'][page.status_code] = stats['statuses'].get(page.status_code, 0) + 1
+
+        if self.metrics is not None:
+
+            self.metrics.observe_request(url, time.perf_counter() - start, page.status_code)
+
+        return page
+
+    def get(self, url: str, **kwargs):
+
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        # close every pooled connection
+
+        with self.lock:
+
+            for session in self.sessions.values():
+
+                session.close()
+
+            self.sessions.clear()
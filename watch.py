@@ -0,0 +1,198 @@
+import logging
+import time
+
+from checkpoint import save_json
+from sku_table import weapon_name, kit_name
+
+
+class FlipWatcher:
+    # keeps the flip table in memory and only recomputes the flips whose prices or listings changed
+
+    def __init__(self, grabber, quality: str = "", interval: float = 60, refine_top: int = 10, publish=None):
+
+        self.grabber = grabber
+        self.quality = quality
+
+        # seconds between the starts of two cycles
+        self.interval = interval
+
+        # how many of the best flips have their snapshots watched, each costs backpack.tf budget
+        self.refine_top = refine_top
+
+        # called with the ranking after every cycle, prints it by default
+        self.publish = publish if publish is not None else self.print_ranking
+
+        # sku to the updatedAt price.tf last reported for it
+        self.updated_at = {}
+
+        # weapon to its price.tf profit and to its refined profit
+        self.flips = {}
+        self.refined = {}
+
+        # weapon to the ids and prices of the best kit and weapon listings last seen
+        self.best_listings = {}
+
+        # map each sku to the weapons whose flips use it
+        self.weapons_by_sku = {}
+
+        for weapon in grabber.load_weapon_names():
+
+            for item_sku in (grabber.sku_table.weapon_sku(weapon, quality), grabber.sku_table.kit_sku(weapon, quality)):
+
+                self.weapons_by_sku.setdefault(item_sku, []).append(weapon)
+
+        self.cycles = 0
+
+    def changed_weapons(self):
+        # download the price list and find the weapons with a kit or weapon price that moved since the last cycle
+        # returns None if the price list could not be downloaded
+
+        price_index = self.grabber.load_price_index()
+
+        if price_index is None:
+
+            return None
+
+        changed = set()
+
+        for item_sku, weapons in self.weapons_by_sku.items():
+
+            updated_at = price_index[item_sku]['updatedAt'] if item_sku in price_index else None
+
+            if item_sku not in self.updated_at or self.updated_at[item_sku] != updated_at:
+
+                self.updated_at[item_sku] = updated_at
+                changed.update(weapons)
+
+        return changed
+
+    def reprice(self, weapons: set):
+        # recompute the price.tf profit of the given weapons from the price list
+        # refreshes are held until every weapon has prioritized its own like a sweep
+
+        self.grabber.refresh_queue.hold()
+
+        try:
+
+            for weapon in weapons:
+
+                weapon_json = self.grabber.check_price(
+                    item_sku=self.grabber.sku_table.weapon_sku(weapon, self.quality))
+                kit_json = self.grabber.check_price(item_sku=self.grabber.sku_table.kit_sku(weapon, self.quality))
+
+                self.flips[weapon] = self.grabber.calc_flip(weapon, weapon_json, kit_json)
+                self.grabber.upper_bounds[(weapon, self.quality)] = self.grabber.calc_flip_bound(weapon_json,
+                                                                                                  kit_json)
+                self.grabber.prioritize_refresh(self.flips[weapon], weapon_json, kit_json)
+
+        finally:
+
+            self.grabber.refresh_queue.release()
+
+    def refine(self, weapons: list):
+        # fetch the snapshots of the given weapons and recompute only the flips whose best listings changed
+        # returns the weapons whose refined profit was recomputed
+
+        banned_attributes = (1004, 1005, 1006, 1007, 1008, 1009)
+
+        recomputed = []
+
+        for weapon in weapons:
+
+            kit_listings = self.grabber.grab_listings(kit_name(weapon, self.quality),
+                                                      banned_attributes=banned_attributes)
+            weapon_listings = self.grabber.grab_listings(weapon_name(weapon, self.quality),
+                                                         banned_attributes=banned_attributes)
+
+            kit_listing = None if kit_listings is None else kit_listings.top('sell')
+            weapon_listing = None if weapon_listings is None else weapon_listings.top('buy')
+
+            best = tuple(None if listing is None else (listing['id'], listing['price'])
+                         for listing in (kit_listing, weapon_listing))
+
+            if weapon in self.best_listings and self.best_listings[weapon] == best:
+
+                continue
+
+            self.best_listings[weapon] = best
+
+            if kit_listing is None or weapon_listing is None:
+
+                self.refined[weapon] = None
+
+            else:
+
+                self.refined[weapon] = weapon_listing['price'] - kit_listing['price']
+
+            recomputed.append(weapon)
+
+        return recomputed
+
+    def ranking(self):
+        # the flips best first, refined profits where we have them and price.tf ones otherwise
+
+        rows = [{'weapon': weapon, 'profit': self.flips[weapon], 'refined': self.refined.get(weapon)}
+                for weapon in self.flips]
+
+        rows.sort(reverse=True, key=lambda row: (row['refined'] is not None, row['refined'] or 0,
+                                                 row['profit'] is not None, row['profit'] or 0))
+
+        return rows
+
+    @staticmethod
+    def print_ranking(rows: list):
+
+        for row in rows[:10]:
+
+            print(f"{row['weapon']:<32} {row['profit']!s:>8} {row['refined']!s:>24}")
+
+    def cycle(self):
+        # run one round of change detection, recomputation and publishing
+
+        changed = self.changed_weapons()
+
+        # if price.tf could not be reached keep the last table and try again next cycle
+        if changed is None:
+
+            self.cycles += 1
+
+            logging.info(f"Cycle {self.cycles}: could not download the price list, keeping the last ranking")
+
+            return set(), []
+
+        self.reprice(changed)
+
+        # watch the snapshots of the flips price.tf rates best
+        watched = sorted((weapon for weapon in self.flips if self.flips[weapon] is not None),
+                         key=lambda weapon: self.flips[weapon], reverse=True)[:self.refine_top]
+
+        recomputed = self.refine(watched)
+
+        self.cycles += 1
+
+        logging.info(f"Cycle {self.cycles}: {len(changed)} repriced and {len(recomputed)} refined")
+
+        self.publish(self.ranking())
+
+        return changed, recomputed
+
+    def run(self, cycles: int = None):
+        # cycle forever or for a number of cycles, starting one every interval seconds
+
+        while cycles is None or self.cycles < cycles:
+
+            start = time.time()
+
+            self.cycle()
+
+            if cycles is not None and self.cycles >= cycles:
+
+                break
+
+            time.sleep(max(self.interval - (time.time() - start), 0))
+
+
+def publish_json(path: str):
+    # publish each ranking by replacing a json file
+
+    return lambda rows: save_json(path, rows)
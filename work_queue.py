@@ -0,0 +1,343 @@
+import multiprocessing
+import threading
+import argparse
+import sqlite3
+import logging
+import socket
+import json
+import time
+import os
+
+from sku_table import load_weapon_names, QUALITIES
+
+
+class WorkQueue:
+    # a durable queue of sweep work units in sqlite that worker processes on one or more hosts claim from
+    # a claimed unit is leased to its worker and goes back to the queue if the lease runs out before it is done
+
+    def __init__(self, path: str = "work_queue.sqlite", lease: float = 10 * 60, max_attempts: int = 3,
+                 shared: bool = False):
+
+        # how many seconds a worker has to finish a unit it claimed
+        self.lease = lease
+
+        # a unit that fails this many times is marked failed instead of being handed out again
+        self.max_attempts = max_attempts
+
+        self.lock = threading.Lock()
+
+        # wait on other processes holding the database instead of failing
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+
+        # wal lets readers and the writer work at once but needs every process on one host
+        # a queue shared over a network filesystem uses the default rollback journal instead
+        # which relies on the filesystem's own locking working across hosts
+        # the mode is kept in the file so it is set either way
+        self.connection.execute(f"PRAGMA journal_mode={'DELETE' if shared else 'WAL'}")
+
+        self.connection.execute("CREATE TABLE IF NOT EXISTS units ("
+                                "id INTEGER PRIMARY KEY, "
+                                "sweep TEXT NOT NULL, "
+                                "task TEXT NOT NULL, "
+                                "weapon TEXT NOT NULL, "
+                                "quality TEXT NOT NULL, "
+                                "priority REAL NOT NULL, "
+                                "state TEXT NOT NULL, "
+                                "worker TEXT, "
+                                "lease_until REAL, "
+                                "attempts INTEGER NOT NULL, "
+                                "result TEXT, "
+                                "UNIQUE (sweep, weapon, quality))")
+
+    def add(self, sweep: str, task: str, units: list):
+        # queue (weapon, quality, priority) units for a sweep, units already queued are left alone
+
+        with self.lock:
+
+            self.connection.execute("BEGIN IMMEDIATE")
+
+            self.connection.executemany("INSERT OR IGNORE INTO units (sweep, task, weapon, quality, priority, state, "
+                                        "attempts) VALUES (?, ?, ?, ?, ?, 'pending', 0)",
+                                        [(sweep, task, weapon, quality, priority)
+                                         for weapon, quality, priority in units])
+
+            self.connection.execute("COMMIT")
+
+    def claim(self, worker: str, count: int = 1, sweep: str = None):
+        # lease up to count units highest priority first, taking back units whose lease ran out
+        # returns (id, sweep, task, weapon, quality, priority) rows
+
+        with self.lock:
+
+            now = time.time()
+
+            # take the write lock first so two workers never claim the same unit
+            self.connection.execute("BEGIN IMMEDIATE")
+
+            # a unit whose lease ran out on its last attempt most likely keeps killing its worker so fail it
+            self.connection.execute("UPDATE units SET state = 'failed', worker = NULL, lease_until = NULL "
+                                    "WHERE state = 'claimed' AND lease_until < ? AND attempts >= ?",
+                                    (now, self.max_attempts))
+
+            rows = self.connection.execute(
+                "SELECT id, sweep, task, weapon, quality, priority FROM units "
+                "WHERE (state = 'pending' OR (state = 'claimed' AND lease_until < ?)) AND (? IS NULL OR sweep = ?) "
+                "ORDER BY priority DESC, id LIMIT ?", (now, sweep, sweep, count)).fetchall()
+
+            self.connection.executemany("UPDATE units SET state = 'claimed', worker = ?, lease_until = ?, "
+                                        "attempts = attempts + 1 WHERE id = ?",
+                                        [(worker, now + self.lease, row[0]) for row in rows])
+
+            self.connection.execute("COMMIT")
+
+        return rows
+
+    def complete(self, unit_id: int, worker: str, result):
+        # save a unit's result, ignored if the lease was lost and the unit handed to someone else
+
+        with self.lock:
+
+            self.connection.execute("UPDATE units SET state = 'done', result = ?, lease_until = NULL "
+                                    "WHERE id = ? AND worker = ? AND state = 'claimed'",
+                                    (json.dumps(result), unit_id, worker))
+
+    def release(self, unit_id: int, worker: str):
+        # give a unit back to the queue ie after the worker failed on it
+
+        with self.lock:
+
+            self.connection.execute("UPDATE units SET "
+                                    "state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                                    "worker = NULL, lease_until = NULL "
+                                    "WHERE id = ? AND worker = ? AND state = 'claimed'",
+                                    (self.max_attempts, unit_id, worker))
+
+    def progress(self, sweep: str):
+        # how many units of a sweep are in each state
+
+        with self.lock:
+
+            return dict(self.connection.execute("SELECT state, COUNT(*) FROM units WHERE sweep = ? GROUP BY state",
+                                                (sweep,)).fetchall())
+
+    def results(self, sweep: str):
+        # (weapon, quality) to the result of every finished unit of a sweep
+
+        with self.lock:
+
+            rows = self.connection.execute("SELECT weapon, quality, result FROM units "
+                                           "WHERE sweep = ? AND state = 'done'", (sweep,)).fetchall()
+
+        return {(weapon, quality): json.loads(result) for weapon, quality, result in rows}
+
+    def close(self):
+
+        with self.lock:
+
+            self.connection.close()
+
+
+def work_units(grabber, task: str, rows: list):
+    # work out the results of a batch of claimed units
+    # returns unit id to result
+
+    results = {}
+
+    if task == "price":
+
+        for unit_id, _, _, weapon, quality, _ in rows:
+
+            weapon_json = grabber.check_price(item_sku=grabber.sku_table.weapon_sku(weapon, quality))
+            kit_json = grabber.check_price(item_sku=grabber.sku_table.kit_sku(weapon, quality))
+
+            results[unit_id] = grabber.calc_flip(weapon, weapon_json, kit_json)
+
+    elif task == "refine":
+
+        # refine each quality's weapons together so their snapshots share one scheduler pass
+        for quality in dict.fromkeys(row[4] for row in rows):
+
+            batch = [row for row in rows if row[4] == quality]
+
+            flips = grabber.refine_ks_flips({row[3]: row[5] for row in batch}, quality=quality)
+
+            for unit_id, _, _, weapon, _, _ in batch:
+
+                results[unit_id] = flips[weapon]
+
+    else:
+
+        raise ValueError(f"Unknown task {task}")
+
+    return results
+
+
+def run_worker(queue: WorkQueue, grabber, sweep: str = None, batch: int = 5, worker: str = None):
+    # claim and work units until the queue has nothing left for us
+
+    worker = worker if worker is not None else f"{socket.gethostname()}:{os.getpid()}"
+
+    done = 0
+
+    while rows := queue.claim(worker, count=batch, sweep=sweep):
+
+        for task in dict.fromkeys(row[2] for row in rows):
+
+            task_rows = [row for row in rows if row[2] == task]
+
+            try:
+
+                results = work_units(grabber, task, task_rows)
+
+            except Exception as error:
+
+                logging.info(f"{worker} failed on {len(task_rows)} units: {error!r}")
+
+                for row in task_rows:
+
+                    queue.release(row[0], worker)
+
+                continue
+
+            for unit_id, result in results.items():
+
+                queue.complete(unit_id, worker, result)
+
+            done += len(results)
+
+    logging.info(f"{worker} finished {done} units")
+
+    return done
+
+
+def coordinate(queue: WorkQueue, sweep: str, task: str = "refine", weapons: list = None,
+               qualities: tuple = ("",), priorities: dict = None):
+    # split a sweep into one unit per weapon and quality
+    # priorities maps (weapon, quality) to ie its price.tf profit so the best flips are worked first
+
+    weapons = weapons if weapons is not None else load_weapon_names()
+    priorities = priorities or {}
+
+    units = []
+
+    for weapon in weapons:
+
+        for quality in qualities:
+
+            priority = priorities.get((weapon, quality))
+
+            units.append((weapon, quality, priority if priority is not None else float('-inf')))
+
+    queue.add(sweep, task, units)
+
+    return len(units)
+
+
+def collect(queue: WorkQueue, sweep: str, poll: float = 5, processes: list = None):
+    # wait for every unit of a sweep to finish or fail and return the results ranked best first
+    # if given the local worker processes stop waiting once all of them have exited
+
+    while (progress := queue.progress(sweep)).get('done', 0) + progress.get('failed', 0) < sum(progress.values()):
+
+        # if every worker died ie on a missing auth.json nobody is left to finish the sweep
+        if processes and not any(process.is_alive() for process in processes):
+
+            logging.info(f"{sweep}: every worker exited with units left unfinished {progress}")
+            break
+
+        logging.info(f"{sweep}: {progress}")
+        time.sleep(poll)
+
+    results = queue.results(sweep)
+
+    return sorted(results.items(), reverse=True, key=lambda item: (item[1] is not None, item[1] or 0))
+
+
+def load_tokens(path: str = "auth.json"):
+    # the backpack.tf tokens in auth.json, which holds one token or a list of them
+
+    with open(path) as file:
+        auth = json.load(file)
+
+    return [auth['token']] if isinstance(auth['token'], str) else list(auth['token']), auth['api_key']
+
+
+def worker_process(path: str, sweep: str, batch: int, shared: bool = False, index: int = 0, workers: int = 1):
+    # the entry point of a local worker process, builds its own grabber from auth.json
+    # each of the workers gets its own slice of the tokens since every grabber spends each of its tokens' budget
+
+    from main4 import PriceGrabber
+
+    tokens, api_key = load_tokens()
+
+    queue = WorkQueue(path, shared=shared)
+
+    run_worker(queue, PriceGrabber(token=tokens[index::workers], api_key=api_key), sweep=sweep, batch=batch)
+
+    queue.close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Run a killstreak sweep sharded over worker processes")
+    parser.add_argument("role", choices=("coordinate", "work"),
+                        help="coordinate queues the sweep and collects it, work only claims units")
+    parser.add_argument("--sweep", help="the sweep's name, workers without one work any sweep")
+    parser.add_argument("--task", choices=("price", "refine"), default="refine")
+    parser.add_argument("--qualities", nargs="*", default=list(QUALITIES))
+    parser.add_argument("--queue", default="work_queue.sqlite", help="the queue file")
+    parser.add_argument("--shared", action="store_true",
+                        help="the queue file is on a network filesystem shared by several hosts")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="local worker processes the coordinator starts, at most one per backpack.tf token")
+    parser.add_argument("--batch", type=int, default=5, help="units a worker claims at once")
+    parser.add_argument("--token-index", type=int, default=0,
+                        help="with --token-count, which slice of the tokens in auth.json this worker uses")
+    parser.add_argument("--token-count", type=int, default=1,
+                        help="how many workers share the tokens in auth.json, each needs its own --token-index")
+    parser.add_argument("--out", default="sharded_flips.json", help="where the coordinator writes the results")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.role == "work":
+
+        # workers on other hosts sharing an auth.json each take their own slice of its tokens like local ones
+        if not 0 <= args.token_index < args.token_count or args.token_count > len(load_tokens()[0]):
+
+            parser.error("--token-index must be below --token-count which cannot be over the tokens in auth.json")
+
+        worker_process(args.queue, args.sweep, args.batch, args.shared, args.token_index, args.token_count)
+
+    else:
+
+        from checkpoint import save_json
+
+        # workers sharing a token would each spend its whole budget and only get 429s
+        if args.workers and args.workers > len(load_tokens()[0]):
+
+            parser.error(f"--workers {args.workers} needs as many backpack.tf tokens in auth.json")
+
+        sweep_name = args.sweep or time.strftime("sweep-%Y%m%d-%H%M%S")
+
+        work_queue = WorkQueue(args.queue, shared=args.shared)
+
+        print(f"Queued {coordinate(work_queue, sweep_name, args.task, qualities=tuple(args.qualities))} units")
+
+        processes = [multiprocessing.Process(target=worker_process,
+                                             args=(args.queue, sweep_name, args.batch, args.shared,
+                                                   index, args.workers))
+                     for index in range(args.workers)]
+
+        for process in processes:
+
+            process.start()
+
+        ranked = collect(work_queue, sweep_name, processes=processes)
+
+        for process in processes:
+
+            process.join()
+
+        save_json(args.out, [[weapon, quality, result] for (weapon, quality), result in ranked])